@@ -1,6 +1,60 @@
+import asyncio
+import operator
+import random
+import sys
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+import instrumentation
+from instrumentation import log, span
 
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для векторного режима
+    np = None
+
+
+# Таблица операций вместо цепочки if/elif
+OPERATIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+
+# Ошибка операции как значение: code - машиночитаемый код, message - текст
+CalculationError = namedtuple('CalculationError', ['code', 'message'])
+
+
+def calculate(operation, a, b):
+    """
+    Выполняет операцию без задержки и вывода
+
+    Возвращает:
+    float или CalculationError
+    """
+    func = OPERATIONS.get(operation)
+    if func is None:
+        return CalculationError('unknown_operation', f"Неизвестная операция: {operation}")
+    try:
+        return func(a, b)
+    except ZeroDivisionError:
+        return CalculationError('division_by_zero', "Деление на ноль")
+    except (TypeError, ValueError, OverflowError, ArithmeticError) as e:
+        # Ошибка одной операции не должна прерывать всю пачку batch_calculate
+        return CalculationError('invalid_operands', f"Некорректные операнды {a!r}, {b!r}: {e}")
+
+
+# Строки, которые sync_calculate исторически возвращает вместо ошибок
+LEGACY_ERROR_MESSAGES = {
+    'division_by_zero': 'Ошибка: деление на ноль',
+    'unknown_operation': 'Неизвестная операция',
+    'invalid_operands': 'Ошибка: некорректные операнды',
+}
+
+
+@span('sync_calculate')
 def sync_calculate(operation, a, b, delay):
     """
     Выполняет математическую операцию с задержкой
@@ -13,21 +67,15 @@ def sync_calculate(operation, a, b, delay):
     Возвращает:
     float: результат операции
     """
-    print(f"Начало операции {a} {operation} {b}")
+    log(f"Начало операции {a} {operation} {b}", event='calculate.start', operation=operation, a=a, b=b)
     time.sleep(delay)  # Имитация долгого вычисления
 
-    if operation == '+':
-        result = a + b
-    elif operation == '-':
-        result = a - b
-    elif operation == '*':
-        result = a * b
-    elif operation == '/':
-        result = a / b if b != 0 else 'Ошибка: деление на ноль'
-    else:
-        result = 'Неизвестная операция'
+    result = calculate(operation, a, b)
+    if isinstance(result, CalculationError):
+        result = LEGACY_ERROR_MESSAGES[result.code]
 
-    print(f"Конец операции {a} {operation} {b} = {result}")
+    log(f"Конец операции {a} {operation} {b} = {result}", event='calculate.end',
+        operation=operation, a=a, b=b, result=result)
     return result
 
 
@@ -54,8 +102,149 @@ def task1_sync_calculations():
     results.append(sync_calculate('/', 100, 5, 1))
 
     end_time = time.time()
+    instrumentation.flush()
     print(f"Общее время выполнения: {end_time - start_time:.2f} секунд")
     print(f"Результаты: {results}")
 
+async def async_calculate(operation, a, b, delay):
+    """Асинхронная версия: ожидание без блокировки потока, без вывода"""
+    await asyncio.sleep(delay)
+    return calculate(operation, a, b)
+
+
+def delayed_calculate(job):
+    """Версия для пула потоков: job = (operation, a, b, delay)"""
+    operation, a, b, delay = job
+    time.sleep(delay)
+    return calculate(operation, a, b)
+
+
+def batch_calculate(jobs, backend='async', concurrency=1000):
+    """
+    Выполняет пачку операций (operation, a, b, delay) параллельно
+
+    backend: 'async' (asyncio, ограничение семафором) или 'thread' (пул потоков)
+    Возвращает результаты в порядке входа; ошибки - значения CalculationError.
+    """
+    jobs = list(jobs)
+    if backend == 'async':
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(job):
+                async with semaphore:
+                    return await async_calculate(*job)
+
+            return await asyncio.gather(*(one(job) for job in jobs))
+
+        return asyncio.run(run())
+    if backend == 'thread':
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(jobs)))) as executor:
+            return list(executor.map(delayed_calculate, jobs))
+    raise ValueError(f"Неизвестный backend: {backend}")
+
+
+# Векторный режим: операция задается кодом - индексом в OP_CODES
+OP_CODES = ('+', '-', '*', '/')
+ERROR_NONE, ERROR_DIVISION_BY_ZERO, ERROR_UNKNOWN_OPERATION = 0, 1, 2
+
+
+def encode_operations(operations):
+    """Переводит символы операций в коды OP_CODES (-1 для неизвестных)"""
+    codes = {symbol: code for code, symbol in enumerate(OP_CODES)}
+    return np.fromiter((codes.get(op, -1) for op in operations), dtype=np.int8)
+
+
+def vectorized_calculate(op_codes, a, b):
+    """
+    Выполняет массив операций за один проход NumPy, без задержек и вывода
+
+    Параметры:
+    op_codes: массив кодов операций (индексы OP_CODES)
+    a, b: массивы операндов
+
+    Возвращает:
+    (values, errors): values - float64 (NaN там, где ошибка),
+    errors - коды ошибок (ERROR_NONE, ERROR_DIVISION_BY_ZERO, ERROR_UNKNOWN_OPERATION)
+    """
+    if np is None:
+        raise ImportError("Для векторного режима нужен numpy")
+    op_codes = np.asarray(op_codes)
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    values = np.full(a.shape, np.nan)
+    errors = np.zeros(a.shape, dtype=np.uint8)
+
+    # where= вычисляет только свои элементы и пишет прямо в values, без копий по маске
+    np.add(a, b, out=values, where=op_codes == 0)
+    np.subtract(a, b, out=values, where=op_codes == 1)
+    np.multiply(a, b, out=values, where=op_codes == 2)
+    division = op_codes == 3
+    zero_division = division & (b == 0)
+    np.divide(a, b, out=values, where=division & ~zero_division)
+
+    errors[zero_division] = ERROR_DIVISION_BY_ZERO
+    errors[(op_codes < 0) | (op_codes >= len(OP_CODES))] = ERROR_UNKNOWN_OPERATION
+    return values, errors
+
+
+def benchmark_vectorized(count=10_000_000, scalar_count=100_000):
+    """Пропускная способность: sync_calculate без задержки против vectorized_calculate"""
+    rng = np.random.default_rng(1)
+    op_codes = rng.integers(0, len(OP_CODES), count, dtype=np.int8)
+    a = rng.integers(-100, 100, count).astype(np.float64)
+    b = rng.integers(-5, 5, count).astype(np.float64)
+
+    jobs = list(zip((OP_CODES[code] for code in op_codes[:scalar_count]),
+                    a[:scalar_count].tolist(), b[:scalar_count].tolist()))
+    start_time = time.perf_counter()
+    with instrumentation.quiet():
+        for operation, x, y in jobs:
+            sync_calculate(operation, x, y, 0)
+    scalar_rate = scalar_count / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    for operation, x, y in jobs:
+        calculate(operation, x, y)
+    plain_rate = scalar_count / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    values, errors = vectorized_calculate(op_codes, a, b)
+    vector_rate = count / (time.perf_counter() - start_time)
+
+    for i in range(1000):
+        expected = calculate(OP_CODES[op_codes[i]], float(a[i]), float(b[i]))
+        if isinstance(expected, CalculationError):
+            assert errors[i] == ERROR_DIVISION_BY_ZERO
+        else:
+            assert values[i] == expected
+    print(f"sync_calculate (delay=0): {scalar_rate:,.0f} операций/сек")
+    print(f"calculate: {plain_rate:,.0f} операций/сек")
+    print(f"vectorized_calculate: {vector_rate:,.0f} операций/сек на {count:,} операциях, "
+          f"делений на ноль: {int((errors == ERROR_DIVISION_BY_ZERO).sum()):,}")
+
+
+def benchmark_batch(count=5000, delay=0.01):
+    """Пачка операций: сумма задержек при последовательном выполнении против async и потоков"""
+    rng = random.Random(1)
+    jobs = [(rng.choice('+-*/%'), rng.randint(0, 100), rng.randint(0, 5), delay) for _ in range(count)]
+    # Некорректные операнды возвращаются ошибкой своей операции, пачка не прерывается
+    jobs[:2] = [('+', 'a', 1, delay), ('/', 10 ** 400, 1, delay)]
+    for backend, concurrency in (('async', 1000), ('thread', 200)):
+        start_time = time.perf_counter()
+        results = batch_calculate(jobs, backend, concurrency)
+        elapsed = time.perf_counter() - start_time
+        assert [result.code for result in results[:2]] == ['invalid_operands', 'invalid_operands'], results[:2]
+        errors = sum(isinstance(result, CalculationError) for result in results)
+        print(f"{backend}: {count} операций за {elapsed:.2f} сек "
+              f"(последовательно было бы {count * delay:.0f} сек), ошибок: {errors}")
+
+
 # Запуск задачи
-task1_sync_calculations()
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        benchmark_batch()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'vector':
+        benchmark_vectorized()
+    else:
+        task1_sync_calculations()
@@ -1,26 +1,178 @@
 import threading
 import time
 import random
+import hashlib
+import itertools
+import json
+import os
+import queue
+import re
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+import instrumentation
+from instrumentation import log, span
 
-def download_file(filename, size):
+
+class DownloadCancelled(Exception):
+    """Загрузка остановлена: отменена или превысила таймаут"""
+
+
+@span('download_file')
+def download_file(filename, size, cancel=None):
     """
     Имитирует загрузку файла
 
     Параметры:
     filename (str): имя файла
     size (int): размер файла в МБ
+    cancel (threading.Event): если установлен, загрузка прерывается между шагами
     """
     download_time = size * 0.1  # 0.1 сек на МБ
-    print(f"Начало загрузки {filename} ({size} МБ)")
+    log(f"Начало загрузки {filename} ({size} МБ)", event='download.start', filename=filename, size_mb=size)
 
     # Имитация прогресса загрузки
     for i in range(5):
-        time.sleep(download_time / 5)
+        if cancel is not None and cancel.wait(download_time / 5):
+            raise DownloadCancelled(f"Загрузка {filename} прервана")
+        if cancel is None:
+            time.sleep(download_time / 5)
         progress = (i + 1) * 20
-        print(f"{filename}: {progress}% загружено")
+        log(f"{filename}: {progress}% загружено", event='download.progress', filename=filename, percent=progress)
+
+    log(f"Завершена загрузка {filename}", event='download.end', filename=filename)
+
+
+class DownloadTask:
+    """Задача планировщика: состояние, результат и отмена"""
+
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+        self.status = 'pending'  # pending, running, done, failed, cancelled, timed_out
+        self.error = None
+        self.timed_out = False
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def cancel(self):
+        """Отменить задачу: из очереди она не запустится, запущенная прервется на ближайшем шаге"""
+        self.cancel_event.set()
+
+    def wait(self, timeout=None):
+        return self.done_event.wait(timeout)
+
+
+# Ключ приоритета очереди по политике планирования (меньше - раньше)
+SCHEDULING_POLICIES = {
+    'fifo': lambda size: 0,
+    'smallest': lambda size: size,  # кратчайшая задача первой: минимум среднего времени ожидания
+    'largest': lambda size: -size,  # длинная задача первой: обычно минимум общего времени
+}
+
+
+class DownloadScheduler:
+    """
+    Фиксированный пул потоков, получающий задачи из очереди с приоритетом
+
+    Поддерживает отмену, таймаут на задачу и метрики (глубина очереди, пропускная способность).
+    """
+
+    def __init__(self, workers=4, policy='smallest', task_timeout=None, download=download_file):
+        self.priority = SCHEDULING_POLICIES[policy]
+        self.task_timeout = task_timeout
+        self.download = download
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._counts = {'submitted': 0, 'done': 0, 'failed': 0, 'cancelled': 0, 'timed_out': 0}
+        self._megabytes = 0
+        self._started = time.perf_counter()
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
 
-    print(f"Завершена загрузка {filename}")
+    def submit(self, filename, size):
+        task = DownloadTask(filename, size)
+        with self._lock:
+            self._counts['submitted'] += 1
+        self._queue.put((self.priority(size), next(self._counter), task))
+        return task
+
+    def _finish(self, task, status, error=None):
+        task.status = status
+        task.error = error
+        task.finished_at = time.perf_counter()
+        with self._lock:
+            self._counts[status] += 1
+            if status == 'done':
+                self._megabytes += task.size
+        task.done_event.set()
+
+    def _worker(self):
+        while True:
+            _, _, task = self._queue.get()
+            if task is None:
+                return
+            if task.cancel_event.is_set():
+                self._finish(task, 'cancelled')
+                continue
+            task.status = 'running'
+            task.started_at = time.perf_counter()
+            timer = None
+            if self.task_timeout is not None:
+                timer = threading.Timer(self.task_timeout, self._expire, (task,))
+                timer.start()
+            try:
+                self.download(task.filename, task.size, task.cancel_event)
+                self._finish(task, 'done')
+            except DownloadCancelled as e:
+                self._finish(task, 'timed_out' if task.timed_out else 'cancelled', e)
+            except Exception as e:
+                self._finish(task, 'failed', e)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    @staticmethod
+    def _expire(task):
+        task.timed_out = True
+        task.cancel_event.set()
+
+    def metrics(self):
+        """Глубина очереди, счетчики по статусам и пропускная способность"""
+        elapsed = time.perf_counter() - self._started
+        with self._lock:
+            metrics = dict(self._counts)
+            megabytes = self._megabytes
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['files_per_sec'] = metrics['done'] / elapsed if elapsed > 0 else 0.0
+        metrics['mb_per_sec'] = megabytes / elapsed if elapsed > 0 else 0.0
+        return metrics
+
+    def shutdown(self, cancel_pending=False):
+        """Дождаться завершения потоков; cancel_pending отменяет еще не начатые задачи"""
+        if cancel_pending:
+            while True:
+                try:
+                    _, _, task = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._finish(task, 'cancelled')
+        for _ in self._threads:
+            self._queue.put((float('inf'), next(self._counter), None))
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
 
 
 def task2_threaded_downloader():
@@ -45,18 +197,314 @@ def task2_threaded_downloader():
     ]
 
     start_time = time.time()
-    threads = []
 
-    for filename, size in files:
-        thread = threading.Thread(target=download_file, args=(filename, size))
-        threads.append(thread)
-        thread.start()
-
-    for thread in threads:
-        thread.join()
+    # Фиксированный пул потоков вместо потока на каждый файл
+    with DownloadScheduler(workers=4, policy='smallest') as scheduler:
+        tasks = [scheduler.submit(filename, size) for filename, size in files]
 
     end_time = time.time()
+    # Явная проверка вместо assert: assert отключается при запуске с -O
+    failed = [task for task in tasks if task.status != 'done']
+    instrumentation.flush()
+    for task in failed:
+        reason = f": {task.error}" if task.error else ""
+        print(f"Файл {task.filename} не загружен (статус {task.status}){reason}")
+    print(f"Загружено файлов: {len(tasks) - len(failed)} из {len(tasks)}")
     print(f"Общее время загрузки: {end_time - start_time:.2f} секунд")
 
+
+class RangeDownloader:
+    """
+    Реальная загрузка файла по HTTP частями (Range) в несколько потоков
+
+    - файл заранее создается нужного размера, части пишутся на свое место через os.pwrite,
+      целиком в памяти файл не держится;
+    - готовые части записываются в манифест <файл>.manifest, после сбоя загрузка
+      продолжается только с недостающих частей; манифест отбрасывается, если файла
+      нет, его размер другой или изменился файл на сервере (ETag / Last-Modified);
+    - прогресс сообщается через progress(загружено_байт, всего_байт).
+    """
+
+    def __init__(self, workers=4, chunk_size=4 * 2**20, block_size=64 * 1024, timeout=30, progress=None):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.timeout = timeout
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._downloaded = 0
+        self._total = 0
+
+    def _probe(self, url):
+        """Размер файла, поддержка Range и версия файла на сервере (HEAD-запрос)"""
+        request = urllib.request.Request(url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            size = int(response.headers.get('Content-Length', -1))
+            version = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            return size, response.headers.get('Accept-Ranges') == 'bytes', version
+
+    def _advance(self, count):
+        with self._lock:
+            self._downloaded += count
+            downloaded = self._downloaded
+        if self.progress is not None:
+            self.progress(downloaded, self._total)
+
+    def _load_manifest(self, manifest_path, path, url, size, version):
+        """Манифест прошлой попытки, если по нему можно докачать, иначе пустой"""
+        new = {'url': url, 'size': size, 'chunk_size': self.chunk_size, 'version': version, 'done': []}
+        if not os.path.exists(manifest_path):
+            return new
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        # Готовые части манифеста лежат в файле: без файла нужного размера они потеряны
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return new
+        if (manifest['url'], manifest['size'], manifest['chunk_size'], manifest.get('version')) != \
+                (url, size, self.chunk_size, version):
+            return new
+        return manifest
+
+    def _save_manifest(self, manifest_path, manifest):
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def _fetch_range(self, url, fd, start, end):
+        request = urllib.request.Request(url, headers={'Range': f'bytes={start}-{end}'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status != 206:
+                raise IOError(f"Сервер не вернул часть {start}-{end} (статус {response.status})")
+            offset = start
+            while offset <= end:
+                block = response.read(min(self.block_size, end - offset + 1))
+                if not block:
+                    raise IOError(f"Соединение оборвано на байте {offset}")
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+                self._advance(len(block))
+
+    def _fetch_whole(self, url, fd):
+        """Запасной путь для серверов без Range: один поток, запись по мере чтения"""
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            offset = 0
+            while True:
+                block = response.read(self.block_size)
+                if not block:
+                    return offset
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+                self._advance(len(block))
+
+    def download(self, url, path):
+        """Загрузить url в path; возвращает размер файла"""
+        size, accepts_ranges, version = self._probe(url)
+        manifest_path = path + '.manifest'
+        self._downloaded = 0
+        self._total = size
+        # Манифест проверяется до открытия: os.open создает отсутствующий файл
+        manifest = self._load_manifest(manifest_path, path, url, size, version)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if size < 0 or not accepts_ranges:
+                size = self._fetch_whole(url, fd)
+                os.ftruncate(fd, size)
+                return size
+
+            if not manifest['done']:
+                os.ftruncate(fd, size)
+            done = set(manifest['done'])
+            if done:
+                self._advance(sum(min(start + self.chunk_size, size) - start for start in done))
+            pending = [start for start in range(0, size, self.chunk_size) if start not in done]
+
+            def fetch(start):
+                self._fetch_range(url, fd, start, min(start + self.chunk_size, size) - 1)
+                with self._lock:
+                    manifest['done'].append(start)
+                    self._save_manifest(manifest_path, manifest)
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(fetch, start) for start in pending]
+                for future in as_completed(futures):
+                    if future.exception() is not None:
+                        # Остальные части не запускаем: докачка продолжится по манифесту
+                        for other in futures:
+                            other.cancel()
+                        raise future.exception()
+        finally:
+            os.close(fd)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return size
+
+
+def print_progress(step=10):
+    """Колбэк прогресса: печатает только при переходе через каждые step процентов"""
+    last = [-step]
+
+    def progress(downloaded, total):
+        percent = downloaded * 100 // total if total > 0 else 0
+        if percent >= last[0] + step or downloaded == total:
+            last[0] = percent - percent % step
+            print(f"Загружено {percent}% ({downloaded} из {total} байт)")
+    return progress
+
+
+def start_range_server(payload, fail_ranges=()):
+    """
+    Локальный HTTP-сервер с поддержкой Range, отдающий payload по любому пути
+
+    Запросы частей, начинающихся с fail_ranges, один раз обрываются (для проверки докачки).
+    Возвращает (сервер, url, статистика); остановка - server.shutdown(), смена файла -
+    server.set_payload(данные).
+    """
+    stats = {'ranges': 0}
+    failing = set(fail_ranges)
+    lock = threading.Lock()
+
+    class RangeRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(self.server.payload)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', self.server.etag)
+            self.end_headers()
+
+        def do_GET(self):
+            payload = self.server.payload
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if not match:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(payload) - 1), len(payload) - 1)
+            with lock:
+                stats['ranges'] += 1
+                fail = start in failing
+                failing.discard(start)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(payload[start:end + 1 if not fail else start + (end - start) // 2])
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+
+    def set_payload(data):
+        server.payload = data
+        server.etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+
+    server.set_payload = set_payload
+    set_payload(payload)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/file.bin", stats
+
+
+def check_range_downloader(size=32 * 2**20, chunk_size=2**20):
+    """Проверка RangeDownloader на локальном сервере: параллельные части и докачка по манифесту"""
+    payload = os.urandom(size)
+    expected = hashlib.sha256(payload).hexdigest()
+    path = 'range_download.bin'
+    chunks = size // chunk_size
+    fail_ranges = [3 * chunk_size, 17 * chunk_size]
+    server, url, stats = start_range_server(payload, fail_ranges)
+    servers = [server]
+    try:
+        start_time = time.perf_counter()
+        for attempt in range(1, len(fail_ranges) + 2):
+            downloader = RangeDownloader(workers=8, chunk_size=chunk_size, progress=print_progress(25))
+            try:
+                downloader.download(url, path)
+                break
+            except IOError as e:
+                print(f"Попытка {attempt} оборвалась: {e}")
+        elapsed = time.perf_counter() - start_time
+        with open(path, 'rb') as f:
+            assert hashlib.sha256(f.read()).hexdigest() == expected
+        # Каждая часть успешно загружена ровно один раз, плюс оборванные запросы
+        assert stats['ranges'] == chunks + len(fail_ranges)
+        assert not os.path.exists(path + '.manifest')
+
+        def interrupted_download(url):
+            """Попытка, оборванная на одной из частей: остаются файл и манифест"""
+            try:
+                RangeDownloader(workers=8, chunk_size=chunk_size).download(url, path)
+            except IOError:
+                pass
+            else:
+                raise AssertionError("загрузка должна была оборваться")
+            assert os.path.exists(path + '.manifest')
+
+        def downloaded_digest(url):
+            RangeDownloader(workers=8, chunk_size=chunk_size).download(url, path)
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+
+        # Файл удален после сбоя, манифест остался: части из манифеста не считаются готовыми
+        servers.append(start_range_server(payload, [5 * chunk_size])[0])
+        url = f"http://127.0.0.1:{servers[-1].server_address[1]}/file.bin"
+        interrupted_download(url)
+        os.remove(path)
+        assert downloaded_digest(url) == expected
+
+        # Файл на сервере изменился (другой ETag при том же размере): загрузка начинается заново
+        servers.append(start_range_server(payload, [5 * chunk_size])[0])
+        url = f"http://127.0.0.1:{servers[-1].server_address[1]}/file.bin"
+        interrupted_download(url)
+        changed = os.urandom(size)
+        servers[-1].set_payload(changed)
+        assert downloaded_digest(url) == hashlib.sha256(changed).hexdigest()
+    finally:
+        for running in servers:
+            running.shutdown()
+        for leftover in (path, path + '.manifest'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    print(f"Проверка пройдена: {chunks} частей за {attempt} попытки, {elapsed:.2f} сек; "
+          f"докачка без файла и после смены файла на сервере начинается заново")
+
+
+def benchmark_scheduling(files=200, workers=8, seed=42):
+    """Общее время (makespan) и среднее время завершения при разных политиках очереди"""
+    rng = random.Random(seed)
+    sizes = [round(rng.lognormvariate(-2.5, 1.0), 3) for _ in range(files)]
+    for policy in SCHEDULING_POLICIES:
+        with instrumentation.quiet():
+            start_time = time.perf_counter()
+            with DownloadScheduler(workers=workers, policy=policy) as scheduler:
+                tasks = [scheduler.submit(f"file{i}.bin", size) for i, size in enumerate(sizes)]
+            makespan = time.perf_counter() - start_time
+        mean_completion = sum(task.finished_at - start_time for task in tasks) / len(tasks)
+        print(f"{policy:>8}: makespan {makespan:.2f} сек, среднее завершение {mean_completion:.2f} сек, "
+              f"{scheduler.metrics()['files_per_sec']:.0f} файлов/сек")
+
+    with instrumentation.quiet():
+        with DownloadScheduler(workers=2, task_timeout=0.05) as scheduler:
+            slow = scheduler.submit("slow.bin", 5)
+            cancelled = scheduler.submit("cancelled.bin", 5)
+            cancelled.cancel()
+            depth = scheduler.metrics()['queue_depth']
+    assert slow.status == 'timed_out' and cancelled.status == 'cancelled'
+    print(f"Таймаут и отмена: {slow.status}, {cancelled.status} (глубина очереди {depth})")
+
+
+CHECKS = {
+    'range': check_range_downloader,
+    'schedule': benchmark_scheduling,
+}
+
+
 # Запуск задачи
-task2_threaded_downloader()
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        CHECKS[sys.argv[1]]()
+    else:
+        task2_threaded_downloader()
@@ -1,37 +1,367 @@
+import hashlib
+import itertools
 import multiprocessing
+import os
+import sys
+import threading
 import time
 import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
 
+import instrumentation
+from instrumentation import log, span
 
+
+@span('calculate_factorial')
 def calculate_factorial(n):
     """
     Вычисляет факториал числа (CPU-intensive операция)
     """
-    print(f"Начало вычисления факториала {n}!")
-    result = math.factorial(n)
-    print(f"Завершено вычисление факториала {n}!")
+    log(f"Начало вычисления факториала {n}!", event='factorial.start', n=n)
+    result = factorial_service.factorial(n)
+    log(f"Завершено вычисление факториала {n}!", event='factorial.end', n=n)
     return result
 
 
+@span('calculate_prime')
 def calculate_prime(n):
     """
     Проверяет, является ли число простым
     """
-    print(f"Начало проверки числа {n} на простоту")
+    log(f"Начало проверки числа {n} на простоту", event='prime.start', n=n)
 
     if n < 2:
         result = False
     else:
         result = all(n % i != 0 for i in range(2, int(math.sqrt(n)) + 1))
 
-    print(f"Число {n} простое: {result}")
+    log(f"Число {n} простое: {result}", event='prime.end', n=n, result=result)
     return result
 
 
-def worker(func, arg, queue):
-    """Функция-воркер для выполнения в процессе"""
-    result = func(arg)
-    queue.put(result)
+# Для n < 3.3 * 10**24 (в том числе всех 64-битных) эти основания дают точный ответ
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+
+def is_prime(n):
+    """
+    Детерминированный тест Миллера-Рабина для 64-битных чисел (без вывода на экран)
+    """
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def is_prime_batch(numbers):
+    """Проверяет пачку чисел на простоту"""
+    return [is_prime(n) for n in numbers]
+
+
+def small_primes(limit):
+    """Простые числа до limit включительно (решето Эратосфена на bytearray)"""
+    if limit < 2:
+        return []
+    sieve = bytearray([1]) * (limit + 1)
+    sieve[0] = sieve[1] = 0
+    for p in range(2, math.isqrt(limit) + 1):
+        if sieve[p]:
+            sieve[p * p::p] = bytes(len(range(p * p, limit + 1, p)))
+    return list(itertools.compress(range(limit + 1), sieve))
+
+
+def primes_in_segment(bounds, base_primes=None):
+    """Простые числа в полуинтервале [start, stop) (один сегмент решета)"""
+    start, stop = bounds
+    start = max(start, 2)
+    if start >= stop:
+        return []
+    if base_primes is None:
+        base_primes = small_primes(math.isqrt(stop - 1))
+    segment = bytearray([1]) * (stop - start)
+    for p in base_primes:
+        first = max(p * p, (start + p - 1) // p * p)
+        if first >= stop:
+            continue
+        segment[first - start::p] = bytes(len(range(first, stop, p)))
+    return list(itertools.compress(range(start, stop), segment))
+
+
+def primes_in_range(start, stop, segment_size=1 << 20):
+    """Сегментированное решето: простые в [start, stop) порциями, память O(segment_size)"""
+    base_primes = small_primes(math.isqrt(max(stop - 1, 0)))
+    for low in range(start, stop, segment_size):
+        yield from primes_in_segment((low, min(low + segment_size, stop)), base_primes)
+
+
+def check_primes_parallel(numbers, pool, chunk_size=10000):
+    """Проверка списка чисел на простоту пачками в пуле процессов"""
+    numbers = list(numbers)
+    chunks = [(is_prime_batch, numbers[i:i + chunk_size]) for i in range(0, len(numbers), chunk_size)]
+    return [flag for flags in pool.run(chunks) for flag in flags]
+
+
+def primes_in_range_parallel(start, stop, pool, segment_size=1 << 20):
+    """Сегменты решета распределяются по процессам пула"""
+    segments = [(primes_in_segment, (low, min(low + segment_size, stop)))
+                for low in range(start, stop, segment_size)]
+    return [p for primes in pool.run(segments) for p in primes]
+
+
+def digit_count(n):
+    """Количество десятичных цифр целого числа без перевода его в строку"""
+    n = abs(n)
+    if n == 0:
+        return 1
+    digits = int(n.bit_length() * 0.30102999566398120) + 1
+    if n < 10 ** (digits - 1):
+        digits -= 1
+    return digits
+
+
+def compact_result(result, mode):
+    """
+    Сжимает результат перед передачей из процесса
+
+    mode: None - как есть, 'digits' - число цифр, 'hash' - sha256,
+    'shm' - байты в разделяемой памяти (передается только имя и размер)
+    """
+    if mode is None or not isinstance(result, int) or isinstance(result, bool):
+        return result
+    if mode == 'digits':
+        return digit_count(result)
+    data = result.to_bytes((result.bit_length() + 7) // 8 or 1, 'little', signed=False)
+    if mode == 'hash':
+        return hashlib.sha256(data).hexdigest()
+    if mode == 'shm':
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        shm.close()
+        # Владельцем сегмента становится родительский процесс: он освободит его в load_shared_result
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return ('shm', shm.name, len(data))
+    raise ValueError(f"Неизвестный режим результата: {mode}")
+
+
+def load_shared_result(value):
+    """Восстанавливает число из разделяемой памяти и освобождает ее"""
+    if not (isinstance(value, tuple) and len(value) == 3 and value[0] == 'shm'):
+        return value
+    _, name, size = value
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return int.from_bytes(shm.buf[:size], 'little')
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def release_pending_results(iterator):
+    """Дочитать оставшиеся результаты после ошибки и освободить их сегменты разделяемой памяти"""
+    while True:
+        try:
+            _, value = next(iterator)
+        except StopIteration:
+            return
+        except Exception:
+            continue
+        load_shared_result(value)
+
+
+def run_task(task):
+    """Выполняет задачу (task_id, func, arg, mode) в процессе пула"""
+    task_id, func, arg, mode = task
+    return task_id, compact_result(func(arg), mode)
+
+
+class CalculationPool:
+    """
+    Постоянный пул процессов для вычислений
+
+    Процессы создаются один раз и переиспользуются между вызовами run().
+    Результаты собираются по номеру задачи и возвращаются в порядке входа.
+    """
+
+    def __init__(self, processes=None, result_mode=None):
+        self.result_mode = result_mode
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.processes)
+
+    def run(self, calculations, chunksize=1, result_mode=None):
+        mode = result_mode if result_mode is not None else self.result_mode
+        tasks = [(task_id, func, arg, mode) for task_id, (func, arg) in enumerate(calculations)]
+        results = {}
+        iterator = self.pool.imap_unordered(run_task, tasks, chunksize)
+        try:
+            for task_id, value in iterator:
+                results[task_id] = load_shared_result(value) if mode == 'shm' else value
+        except BaseException:
+            if mode == 'shm':
+                release_pending_results(iterator)
+            raise
+        return [results[task_id] for task_id in range(len(tasks))]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def product_of_range(bounds):
+    """
+    Произведение целых чисел low..high включительно
+
+    Бинарное разбиение: перемножаются числа близкой длины, что быстрее
+    последовательного умножения большого числа на маленькое
+    """
+    low, high = bounds
+    if low > high:
+        return 1
+    if high - low < 16:
+        result = 1
+        for k in range(low, high + 1):
+            result *= k
+        return result
+    mid = (low + high) // 2
+    return product_of_range((low, mid)) * product_of_range((mid + 1, high))
+
+
+def product_tree(values):
+    """Перемножает числа попарно (дерево произведений)"""
+    values = list(values) or [1]
+    while len(values) > 1:
+        pairs = [values[i] * values[i + 1] for i in range(0, len(values) - 1, 2)]
+        if len(values) % 2:
+            pairs.append(values[-1])
+        values = pairs
+    return values[0]
+
+
+class FactorialService:
+    """
+    Сервис вычисления факториалов
+
+    - хранит последние результаты (контрольные точки) в ограниченном LRU-кэше
+      и получает близкие n из ближайшей точки домножением или делением;
+    - очень большие n делит на отрезки и считает их произведения в пуле процессов;
+    - число цифр и остаток по модулю считает без построения полного числа.
+
+    Кэш общий для потоков и защищен блокировкой; сами вычисления идут без нее.
+    """
+
+    def __init__(self, max_checkpoints=16, pool=None, parallel_threshold=100_000):
+        self.max_checkpoints = max_checkpoints
+        self.pool = pool
+        self.parallel_threshold = parallel_threshold
+        self._checkpoints = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.derived = 0
+
+    def _remember(self, n, value):
+        with self._lock:
+            self._checkpoints[n] = value
+            self._checkpoints.move_to_end(n)
+            while len(self._checkpoints) > self.max_checkpoints:
+                self._checkpoints.popitem(last=False)
+
+    def _nearest_checkpoint(self, n):
+        """Ближайшая контрольная точка (k, k!) или None; значение читается под той же блокировкой"""
+        with self._lock:
+            if not self._checkpoints:
+                return None
+            k = min(self._checkpoints, key=lambda k: abs(k - n))
+            return k, self._checkpoints[k]
+
+    def _cached(self, n):
+        with self._lock:
+            value = self._checkpoints.get(n)
+            if value is not None:
+                self.hits += 1
+                self._checkpoints.move_to_end(n)
+            return value
+
+    def factorial(self, n):
+        if n < 0:
+            raise ValueError("Факториал определен только для неотрицательных чисел")
+        result = self._cached(n)
+        if result is not None:
+            return result
+
+        nearest = self._nearest_checkpoint(n)
+        # Производная точка выгодна, только если отрезок между n и k короткий
+        if nearest is not None and abs(n - nearest[0]) <= max(n // 8, 1):
+            k, value = nearest
+            with self._lock:
+                self.derived += 1
+            if k < n:
+                result = value * product_of_range((k + 1, n))
+            else:
+                result = value // product_of_range((n + 1, k))
+        elif self.pool is not None and n >= self.parallel_threshold:
+            result = self.parallel_factorial(n)
+        else:
+            result = math.factorial(n)
+        self._remember(n, result)
+        return result
+
+    def parallel_factorial(self, n, chunks=None):
+        """Факториал, где произведения отрезков [1..n] считаются в процессах пула"""
+        chunks = chunks or self.pool.processes * 4
+        step = max(n // chunks, 1)
+        bounds = [(low, min(low + step - 1, n)) for low in range(1, n + 1, step)]
+        parts = self.pool.run([(product_of_range, b) for b in bounds], result_mode='shm')
+        return product_tree(parts)
+
+    def digit_count(self, n):
+        """Количество цифр n! через lgamma, без вычисления самого факториала"""
+        value = self._cached(n)
+        if value is not None:
+            return digit_count(value)
+        log10 = math.lgamma(n + 1) / math.log(10)
+        # Вблизи целого значения точности float недостаточно - считаем точно
+        if abs(log10 - round(log10)) < 1e-9 * max(log10, 1):
+            return digit_count(self.factorial(n))
+        return int(log10) + 1
+
+    def factorial_mod(self, n, modulus):
+        """n! по модулю, без построения полного числа"""
+        if n < 0:
+            raise ValueError("Факториал определен только для неотрицательных чисел")
+        if modulus < 1:
+            raise ValueError("Модуль должен быть натуральным числом")
+        if modulus == 1 or n >= modulus:
+            return 0
+        result = 1
+        for k in range(2, n + 1):
+            result = result * k % modulus
+        return result
+
+
+factorial_service = FactorialService()
 
 
 def task3_multiprocess_calculations():
@@ -49,31 +379,16 @@ def task3_multiprocess_calculations():
     print("=== МНОГОПРОЦЕССНОЕ ВЫПОЛНЕНИЕ ===")
     start_time = time.time()
 
-    processes = []
-    queue = multiprocessing.Queue()
-    results = []
-
-    # Создаем и запускаем процессы
-    for func, arg in calculations:
-        process = multiprocessing.Process(
-            target=worker,
-            args=(func, arg, queue)
-        )
-        processes.append(process)
-        process.start()
-
-    # Дожидаемся завершения всех процессов
-    for process in processes:
-        process.join()
-
-    # Получаем результаты из очереди
-    while not queue.empty():
-        results.append(queue.get())
+    # Пул процессов создается один раз; факториалы возвращаются числом цифр,
+    # чтобы не передавать через pickle многотысячезначные числа
+    with CalculationPool(result_mode='digits') as pool:
+        results = pool.run(calculations)
 
     end_time = time.time()
     multiprocess_time = end_time - start_time
 
     # Синхронное выполнение для сравнения
+    instrumentation.flush()
     print("\n=== СИНХРОННОЕ ВЫПОЛНЕНИЕ ===")
     start_time = time.time()
 
@@ -84,6 +399,7 @@ def task3_multiprocess_calculations():
     end_time = time.time()
     sync_time = end_time - start_time
 
+    instrumentation.flush()
     print(f"\nСравнение времени:")
     print(f"Многопроцессное: {multiprocess_time:.2f} сек")
     print(f"Синхронное: {sync_time:.2f} сек")
@@ -93,6 +409,113 @@ def task3_multiprocess_calculations():
         print(f"Ускорение: {acceleration:.2f}x")
 
 
+def benchmark_primes(start=10_000_000, count=200_000, range_stop=50_000_000):
+    """Сравнение calculate_prime с пакетным Миллером-Рабином и решетом"""
+    candidates = list(range(start, start + count))
+
+    start_time = time.perf_counter()
+    with instrumentation.quiet():
+        expected = [calculate_prime(n) for n in candidates]
+    trial_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batch = is_prime_batch(candidates)
+    batch_time = time.perf_counter() - start_time
+
+    with CalculationPool() as pool:
+        start_time = time.perf_counter()
+        parallel = check_primes_parallel(candidates, pool)
+        parallel_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        sieved = primes_in_range_parallel(start, start + count, pool)
+        sieve_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        total = len(primes_in_range_parallel(0, range_stop, pool))
+        range_time = time.perf_counter() - start_time
+
+    assert expected == batch == parallel
+    assert sieved == list(itertools.compress(candidates, expected))
+    print(f"calculate_prime: {count / trial_time:.0f} чисел/сек")
+    print(f"is_prime_batch: {count / batch_time:.0f} чисел/сек")
+    print(f"check_primes_parallel: {count / parallel_time:.0f} чисел/сек")
+    print(f"Решето на том же интервале: {count / sieve_time:.0f} чисел/сек")
+    print(f"Решето [0, {range_stop}): {total} простых за {range_time:.2f} сек")
+
+
+def benchmark_factorial(values=(10000, 8000, 10050, 9990, 20000, 20100, 19900, 10000)):
+    """Сравнение math.factorial на каждый вызов с FactorialService"""
+    start_time = time.perf_counter()
+    expected = [math.factorial(n) for n in values]
+    plain_time = time.perf_counter() - start_time
+
+    service = FactorialService()
+    start_time = time.perf_counter()
+    cached = [service.factorial(n) for n in values]
+    service_time = time.perf_counter() - start_time
+    assert cached == expected
+
+    # Общий сервис из нескольких потоков: вытеснение точек не мешает соседним вызовам
+    numbers = [1000 + i * 7919 % 1000 for i in range(2000)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # частые переключения потоков, чтобы гонка проявлялась
+    try:
+        for _ in range(3):
+            shared = FactorialService(max_checkpoints=2)
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                assert list(executor.map(shared.factorial, numbers)) == [math.factorial(n) for n in numbers]
+    finally:
+        sys.setswitchinterval(switch_interval)
+    try:
+        service.factorial_mod(-3, 7)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("factorial_mod принял отрицательное n")
+
+    n = 300_000
+    start_time = time.perf_counter()
+    expected_big = math.factorial(n)
+    single_time = time.perf_counter() - start_time
+    with CalculationPool() as pool:
+        start_time = time.perf_counter()
+        assert FactorialService(pool=pool).parallel_factorial(n) == expected_big
+        parallel_time = time.perf_counter() - start_time
+
+        # Ошибка одной задачи не должна оставлять сегменты разделяемой памяти остальных
+        shm_before = set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+        failing = [(product_of_range, ('x', 1))] + [(product_of_range, (1, 20_000))] * (pool.processes * 4)
+        try:
+            pool.run(failing, result_mode='shm')
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("ошибка задачи не передана из пула")
+    # Проверка после закрытия пула: к этому моменту все задачи завершены
+    if os.path.isdir('/dev/shm'):
+        leaked = set(os.listdir('/dev/shm')) - shm_before
+        assert not leaked, f"Не освобождены сегменты: {sorted(leaked)}"
+
+    start_time = time.perf_counter()
+    digits = service.digit_count(10 ** 7)
+    digits_time = time.perf_counter() - start_time
+
+    print(f"math.factorial: {plain_time * 1000:.1f} мс, FactorialService: {service_time * 1000:.1f} мс "
+          f"(попаданий {service.hits}, производных {service.derived})")
+    print(f"{n}!: один процесс {single_time:.2f} сек, пул процессов {parallel_time:.2f} сек")
+    print(f"Цифр в 10000000!: {digits} за {digits_time * 1e6:.0f} мкс")
+
+
+BENCHMARKS = {
+    'primes': benchmark_primes,
+    'factorial': benchmark_factorial,
+}
+
+
 # Запуск задачи
 if __name__ == "__main__":
-    task3_multiprocess_calculations()
+    if len(sys.argv) > 1:
+        BENCHMARKS[sys.argv[1]]()
+    else:
+        task3_multiprocess_calculations()
@@ -1,24 +1,497 @@
 import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
 import aiohttp
 import time
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from aiohttp import web
 
+import instrumentation
+from instrumentation import log, metrics, span
 
-async def fetch_url(session, url, name):
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+CHUNK_SIZE = 64 * 1024
+
+
+class RetryableStatus(Exception):
+    """Сервер ответил статусом, после которого имеет смысл повторить запрос"""
+
+
+class BodyTooLarge(Exception):
+    """Тело ответа превысило заданный лимит, чтение прервано"""
+
+
+async def stream_body(response, sink=None, max_bytes=None, chunk_size=CHUNK_SIZE):
+    """
+    Читает тело ответа кусками и возвращает число байтов
+
+    В памяти держится только текущий кусок. sink - объект с write() (файл)
+    или update() (hashlib); при превышении max_bytes чтение прерывается.
+    """
+    if max_bytes is not None and (response.content_length or 0) > max_bytes:
+        raise BodyTooLarge(f"Content-Length {response.content_length} > {max_bytes}")
+    write = sink_writer(sink)
+    size = 0
+    async for chunk in response.content.iter_chunked(chunk_size):
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise BodyTooLarge(f"больше {max_bytes} байт")
+        if write is not None:
+            write(chunk)
+    return size
+
+
+def sink_writer(sink):
+    """Функция записи куска в sink: write() у файла, update() у hashlib, None без sink"""
+    if sink is None:
+        return None
+    return sink.write if hasattr(sink, 'write') else sink.update
+
+
+def parse_cache_control(value):
+    """Разбирает заголовок Cache-Control в словарь директив"""
+    directives = {}
+    for part in (value or '').split(','):
+        key, _, argument = part.strip().partition('=')
+        if key:
+            directives[key.lower()] = argument.strip('"') or True
+    return directives
+
+
+class HashingWriter:
+    """Пишет куски в файл и одновременно считает sha256; sink получает копию кусков"""
+
+    def __init__(self, f, sink=None):
+        self.f = f
+        self.digest = hashlib.sha256()
+        self.sink_write = sink_writer(sink)
+
+    def write(self, chunk):
+        self.f.write(chunk)
+        self.digest.update(chunk)
+        if self.sink_write is not None:
+            self.sink_write(chunk)
+
+
+class HttpCache:
+    """
+    Дисковый HTTP-кэш для скрапера
+
+    Тела хранятся по sha256 содержимого (одинаковые страницы занимают место один раз),
+    метаданные - в index.json. Учитывается Cache-Control (max-age, no-cache, no-store),
+    устаревшие записи перепроверяются через If-None-Match / If-Modified-Since,
+    при превышении max_bytes вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, directory='.http_cache', max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _save_index(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def lookup(self, url):
+        entry = self.index.get(url)
+        if entry is not None:
+            entry['last_used'] = time.time()
+        return entry
+
+    def is_fresh(self, entry):
+        if entry.get('no_cache') or entry.get('max_age') is None:
+            return False
+        return time.time() - entry['stored_at'] < entry['max_age']
+
+    def conditional_headers(self, entry):
+        """Заголовки для условного запроса по сохраненной записи"""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _freshness(self, headers):
+        directives = parse_cache_control(headers.get('Cache-Control'))
+        max_age = directives.get('max-age')
+        return {
+            'max_age': int(max_age) if isinstance(max_age, str) and max_age.isdigit() else None,
+            'no_cache': 'no-cache' in directives,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored_at': time.time(),
+            'last_used': time.time(),
+        }
+
+    def storable(self, headers):
+        return 'no-store' not in parse_cache_control(headers.get('Cache-Control'))
+
+    def read_body(self, entry):
+        with open(self._object_path(entry['digest']), 'rb') as f:
+            return f.read()
+
+    def copy_body(self, entry, sink, chunk_size=CHUNK_SIZE):
+        """Переписать сохраненное тело в sink кусками"""
+        write = sink_writer(sink)
+        with open(self._object_path(entry['digest']), 'rb') as f:
+            while chunk := f.read(chunk_size):
+                write(chunk)
+
+    def revalidated(self, url, headers):
+        """
+        Сервер ответил 304: запись снова свежая
+
+        Обновляются только поля, заголовки которых пришли в 304: без Cache-Control
+        сохраняются прежние max-age и no-cache, без ETag - прежний ETag.
+        """
+        self.revalidations += 1
+        entry = self.index[url]
+        freshness = self._freshness(headers)
+        if headers.get('Cache-Control') is None:
+            del freshness['max_age'], freshness['no_cache']
+        for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified')):
+            if headers.get(header) is None:
+                del freshness[key]
+        entry.update(freshness)
+        self._save_index()
+
+    async def store(self, url, response, max_bytes=None, chunk_size=CHUNK_SIZE, sink=None):
+        """Потоково сохранить тело ответа 200 в кэш (и копию в sink); возвращает размер"""
+        self.misses += 1
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer = HashingWriter(f, sink)
+                size = await stream_body(response, writer, max_bytes, chunk_size)
+            digest = writer.digest.hexdigest()
+            path = self._object_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        entry = {'digest': digest, 'size': size, 'status': response.status}
+        entry.update(self._freshness(response.headers))
+        previous = self.index.get(url)
+        self.index[url] = entry
+        if previous is not None:
+            # Старое тело этого URL больше не нужно, если на него не ссылается другая запись
+            self._remove_unreferenced(previous['digest'])
+        self._evict()
+        self._save_index()
+        return size
+
+    def _remove_unreferenced(self, digest):
+        if all(entry['digest'] != digest for entry in self.index.values()):
+            try:
+                os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _disk_objects(self):
+        """Размеры файлов объектов на диске: {digest: байт}"""
+        sizes = {}
+        objects = os.path.join(self.directory, 'objects')
+        for prefix in os.listdir(objects):
+            for digest in os.listdir(os.path.join(objects, prefix)):
+                sizes[digest] = os.path.getsize(os.path.join(objects, prefix, digest))
+        return sizes
+
+    def _evict(self):
+        """
+        Вытеснять записи по давности использования, пока объем объектов на диске больше max_bytes
+
+        Считаются файлы на диске, а не только записи индекса: объекты без записи
+        (например, оставшиеся после сбоя) удаляются первыми.
+        """
+        sizes = self._disk_objects()
+        referenced = {entry['digest'] for entry in self.index.values()}
+        for digest in sizes.keys() - referenced:
+            self._remove_unreferenced(digest)
+        total = sum(sizes[digest] for digest in referenced if digest in sizes)
+        for url in sorted(self.index, key=lambda u: self.index[u]['last_used']):
+            if total <= self.max_bytes:
+                break
+            digest = self.index.pop(url)['digest']
+            if all(entry['digest'] != digest for entry in self.index.values()):
+                total -= sizes.get(digest, 0)
+                self._remove_unreferenced(digest)
+
+    def total_size(self):
+        """Объем объектов кэша на диске"""
+        return sum(self._disk_objects().values())
+
+
+async def fetch_once(session, url, retry_statuses=RETRY_STATUSES, stream=False, sink=None,
+                     max_bytes=None, chunk_size=CHUNK_SIZE, cache=None):
+    """
+    Один запрос без обработки ошибок: возвращает (статус, размер тела в байтах)
+
+    stream=True или sink читают тело потоково; sink может быть путем к файлу.
+    С cache свежая запись отдается без запроса (статус 200), устаревшая
+    перепроверяется условным запросом (статус 304, если не изменилась);
+    sink в обоих случаях получает тело из кэша.
+    """
+    if isinstance(sink, (str, os.PathLike)):
+        with open(sink, 'wb') as f:
+            return await fetch_once(session, url, retry_statuses, stream, f, max_bytes, chunk_size, cache)
+    entry = None
+    headers = {}
+    if cache is not None:
+        entry = cache.lookup(url)
+        if entry is not None and cache.is_fresh(entry):
+            cache.hits += 1
+            if sink is not None:
+                cache.copy_body(entry, sink, chunk_size)
+            return 200, entry['size']
+        headers = cache.conditional_headers(entry)
+    async with session.get(url, headers=headers) as response:
+        if response.status in retry_statuses:
+            raise RetryableStatus(f"статус {response.status}")
+        if cache is not None:
+            if response.status == 304 and entry is not None:
+                cache.revalidated(url, response.headers)
+                if sink is not None:
+                    cache.copy_body(entry, sink, chunk_size)
+                return 304, entry['size']
+            if response.status == 200 and cache.storable(response.headers):
+                return 200, await cache.store(url, response, max_bytes, chunk_size, sink)
+        if stream or sink is not None or max_bytes is not None:
+            return response.status, await stream_body(response, sink, max_bytes, chunk_size)
+        # Для размера достаточно байтов, декодировать тело в строку не нужно
+        content = await response.read()
+        return response.status, len(content)
+
+
+@span('fetch_url')
+async def fetch_url(session, url, name, stream=False, sink=None, max_bytes=None, cache=None):
     """
     Асинхронно загружает веб-страницу
     """
-    print(f"Начало загрузки {name}")
+    log(f"Начало загрузки {name}", event='fetch.start', name=name, url=url)
 
     try:
-        async with session.get(url) as response:
-            content = await response.text()
-            print(f"Завершена загрузка {name}, статус: {response.status}")
-            return len(content)
+        status, size = await fetch_once(session, url, retry_statuses=(), stream=stream,
+                                        sink=sink, max_bytes=max_bytes, cache=cache)
+        log(f"Завершена загрузка {name}, статус: {status}", event='fetch.end',
+            name=name, url=url, status=status, size=size)
+        return size
     except Exception as e:
-        print(f"Ошибка при загрузке {name}: {e}")
+        log(f"Ошибка при загрузке {name}: {e}", event='fetch.error', name=name, url=url, error=str(e))
         return 0
 
 
+class ScraperEngine:
+    """
+    Асинхронный загрузчик для большого числа URL
+
+    - одна ClientSession с пулом keep-alive соединений и лимитом на хост;
+    - семафор ограничивает число одновременных запросов;
+    - таймауты и повторы с экспоненциальной задержкой;
+    - stream=True читает тела кусками, память не зависит от размера страниц.
+    """
+
+    def __init__(self, concurrency=10, per_host=4, timeout=10.0, retries=3, backoff=0.5,
+                 stream=False, max_bytes=None, chunk_size=CHUNK_SIZE, cache=None):
+        self.cache = cache
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.per_host, keepalive_timeout=30
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    @span('scraper_fetch')
+    async def fetch(self, url, name, sink=None):
+        """
+        Загрузить URL с повторами; возвращает размер тела или 0 после всех неудачных попыток
+
+        Если sink - путь, файл перезаписывается на каждой попытке; объект-приемник
+        (файл, hashlib) нельзя откатить, поэтому с ним запрос не повторяется.
+        """
+        retries = self.retries if sink is None or isinstance(sink, (str, os.PathLike)) else 0
+        async with self.semaphore:
+            log(f"Начало загрузки {name}", event='fetch.start', name=name, url=url)
+            for attempt in range(retries + 1):
+                try:
+                    status, size = await fetch_once(
+                        self.session, url, stream=self.stream, sink=sink,
+                        max_bytes=self.max_bytes, chunk_size=self.chunk_size, cache=self.cache
+                    )
+                    log(f"Завершена загрузка {name}, статус: {status}", event='fetch.end',
+                        name=name, url=url, status=status, size=size, attempt=attempt + 1)
+                    return size
+                except BodyTooLarge as e:
+                    log(f"Загрузка {name} прервана: {e}", event='fetch.too_large', name=name, url=url)
+                    metrics.inc('scraper_failures_total', reason='too_large')
+                    return 0
+                except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+                    error = str(e) or type(e).__name__
+                    if attempt == retries:
+                        log(f"Ошибка при загрузке {name}: {error}", event='fetch.error',
+                            name=name, url=url, error=error, attempt=attempt + 1)
+                        metrics.inc('scraper_failures_total', reason='error')
+                        return 0
+                    delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                    log(f"{name}: попытка {attempt + 1} не удалась ({error}), повтор через {delay:.2f} сек",
+                        event='fetch.retry', name=name, url=url, error=error, attempt=attempt + 1, delay=delay)
+                    metrics.inc('scraper_retries_total')
+                    await asyncio.sleep(delay)
+
+    async def fetch_all(self, urls):
+        """Загрузить список (url, name); результаты в порядке входа"""
+        return await asyncio.gather(*(self.fetch(url, name) for url, name in urls))
+
+
+def create_httpbin_app():
+    """
+    Локальная замена httpbin.org: /delay/{n} отвечает через n секунд,
+    /flaky/{n} первые n раз отвечает 503, /status/{code} - заданным статусом,
+    /bytes/{n} потоково отдает n байт, /cache/{n} - n байт с ETag, Last-Modified
+    и Cache-Control из параметра ?cc=, отвечая 304 на совпадающий If-None-Match
+    (с ?changing=1 каждый полный ответ - новое тело с новым ETag)
+    """
+    stats = {'active': 0, 'max_active': 0, 'attempts': {}, 'full': 0, 'not_modified': 0}
+    last_modified = formatdate(time.time() - 3600, usegmt=True)
+
+    async def delay(request):
+        stats['active'] += 1
+        stats['max_active'] = max(stats['max_active'], stats['active'])
+        try:
+            seconds = min(float(request.match_info['seconds']), 10)
+            await asyncio.sleep(seconds)
+            return web.json_response({'url': str(request.url), 'delay': seconds, 'headers': dict(request.headers)})
+        finally:
+            stats['active'] -= 1
+
+    async def flaky(request):
+        attempts = stats['attempts'].get(request.path_qs, 0) + 1
+        stats['attempts'][request.path_qs] = attempts
+        if attempts <= int(request.match_info['failures']):
+            return web.Response(status=503)
+        return web.json_response({'attempts': attempts})
+
+    async def status(request):
+        return web.Response(status=int(request.match_info['code']))
+
+    async def stream_bytes(request):
+        total = int(request.match_info['size'])
+        response = web.StreamResponse()
+        response.content_length = total
+        await response.prepare(request)
+        block = b'x' * (1 << 20)
+        try:
+            for start in range(0, total, len(block)):
+                await response.write(block[:total - start])
+            await response.write_eof()
+        except ConnectionError:
+            pass  # клиент прервал чтение (например, по лимиту размера)
+        return response
+
+    async def cached(request):
+        size = int(request.match_info['size'])
+        version = request.query.get("version", "1")
+        if 'changing' in request.query:
+            version = str(stats['full'])  # каждый полный ответ - новое содержимое
+        etag = f'"{size}-{version}"'
+        headers = {'ETag': etag, 'Last-Modified': last_modified}
+        if 'cc' in request.query:
+            headers['Cache-Control'] = request.query['cc']
+        if request.headers.get('If-None-Match') == etag:
+            stats['not_modified'] += 1
+            return web.Response(status=304, headers=headers)
+        stats['full'] += 1
+        body = b'c' * size if 'changing' not in request.query else version.encode().rjust(size, b'c')
+        return web.Response(body=body, headers=headers)
+
+    app = web.Application()
+    app['stats'] = stats
+    app.router.add_get('/delay/{seconds}', delay)
+    app.router.add_get('/flaky/{failures}', flaky)
+    app.router.add_get('/status/{code}', status)
+    app.router.add_get('/bytes/{size}', stream_bytes)
+    app.router.add_get('/cache/{size}', cached)
+    return app
+
+
+@asynccontextmanager
+async def local_httpbin(app=None):
+    """Запустить локальный сервер на свободном порту; отдает (базовый URL, app)"""
+    app = app or create_httpbin_app()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}", app
+    finally:
+        await runner.cleanup()
+
+
+async def check_scraper_local():
+    """Проверка ScraperEngine на локальном сервере: лимиты, повторы, таймауты"""
+    async with local_httpbin() as (base, app):
+        urls = [(f"{base}/delay/0.2", f"Сайт {i}") for i in range(20)]
+        async with ScraperEngine(concurrency=5, per_host=5, backoff=0.05) as engine:
+            start_time = time.perf_counter()
+            sizes = await engine.fetch_all(urls)
+            elapsed = time.perf_counter() - start_time
+            assert all(size > 0 for size in sizes)
+            assert app['stats']['max_active'] <= 5
+            # 20 запросов по 0.2 сек при 5 одновременных - не меньше 4 волн
+            assert elapsed >= 0.8
+
+            assert await engine.fetch(f"{base}/flaky/2?id=1", "Нестабильный сайт") > 0
+            assert await engine.fetch(f"{base}/status/503", "Недоступный сайт") == 0
+
+        async with ScraperEngine(timeout=0.3, retries=1, backoff=0.05) as engine:
+            assert await engine.fetch(f"{base}/delay/2", "Медленный сайт") == 0
+    instrumentation.flush()
+    print(f"Проверка пройдена: {len(urls)} URL за {elapsed:.2f} сек, "
+          f"максимум одновременных запросов {app['stats']['max_active']}")
+
+
 async def task4_async_scraper():
     """
     Задача: Создайте асинхронный веб-скрапер.
@@ -45,22 +518,107 @@ async def task4_async_scraper():
     start_time = time.time()
 
     # Ваш код здесь
-    # Создаем ClientSession
-    async with aiohttp.ClientSession() as session:
-        # Создаем задачи для каждого URL
-        tasks = [
-            fetch_url(session, url, name)
-            for url, name in urls
-        ]
-
-        # Используем asyncio.gather для параллельного выполнения
-        results = await asyncio.gather(*tasks)
+    # ScraperEngine держит одну сессию с пулом keep-alive соединений,
+    # ограничивает число одновременных запросов и повторяет неудачные
+    # Повторный запуск берет неизменившиеся страницы из дискового кэша
+    async with ScraperEngine(concurrency=10, per_host=4, timeout=15, cache=HttpCache()) as engine:
+        results = await engine.fetch_all(urls)
 
     end_time = time.time()
+    instrumentation.flush()
     print(f"Общее время выполнения: {end_time - start_time:.2f} секунд")
     print(f"Размеры контента: {results}")
 
 
+async def benchmark_streaming_memory(size=100 * 2**20):
+    """Пиковая память: чтение тела целиком против потокового чтения (тело 100 МБ)"""
+    async with local_httpbin() as (base, app):
+        url = f"{base}/bytes/{size}"
+        for stream in (False, True):
+            async with ScraperEngine(timeout=None, stream=stream) as engine:
+                tracemalloc.start()
+                start_time = time.perf_counter()
+                downloaded = await engine.fetch(url, "Большая страница")
+                elapsed = time.perf_counter() - start_time
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            mode = "потоково" if stream else "целиком"
+            instrumentation.flush()
+            print(f"{mode}: {downloaded / 2**20:.0f} МБ за {elapsed:.2f} сек, пик памяти {peak / 2**20:.1f} МБ")
+
+        digest = hashlib.sha256()
+        async with ScraperEngine(timeout=None) as engine:
+            await engine.fetch(url, "Хэш страницы", sink=digest)
+        async with ScraperEngine(timeout=None, max_bytes=2**20) as engine:
+            assert await engine.fetch(url, "Страница сверх лимита") == 0
+        instrumentation.flush()
+        print(f"sha256: {digest.hexdigest()}")
+
+
+async def check_http_cache():
+    """Проверка HttpCache на локальном сервере: свежесть, 304, no-store, вытеснение"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = HttpCache(directory, max_bytes=25_000)
+        async with local_httpbin() as (base, app), ScraperEngine(cache=cache) as engine:
+            stats = app['stats']
+            fresh = f"{base}/cache/1000?cc=max-age%3D60"
+            assert await engine.fetch(fresh, "Свежая") == 1000 and stats['full'] == 1
+            assert await engine.fetch(fresh, "Свежая из кэша") == 1000 and stats['full'] == 1
+            # 304 без Cache-Control не сбрасывает max-age записи
+            cache.revalidated(fresh, {'ETag': cache.index[fresh]['etag']})
+            assert cache.index[fresh]['max_age'] == 60 and cache.is_fresh(cache.index[fresh])
+
+            stale = f"{base}/cache/2000?cc=no-cache"
+            await engine.fetch(stale, "Перепроверка")
+            assert await engine.fetch(stale, "Перепроверка") == 2000
+            assert stats['full'] == 2 and stats['not_modified'] == 1
+
+            changed = f"{base}/cache/2000?cc=no-cache&version=2"
+            await engine.fetch(changed, "Та же страница, другой URL")
+            assert cache.total_size() == 3000  # одинаковое содержимое хранится один раз
+
+            # sink получает тело и при загрузке в кэш, и при попадании, и после 304
+            for url, size in ((f"{base}/cache/3000?cc=max-age%3D60", 3000), (fresh, 1000), (stale, 2000)):
+                for _ in range(2):
+                    path = os.path.join(directory, 'body.bin')
+                    await fetch_once(engine.session, url, sink=path, cache=cache)
+                    assert os.path.getsize(path) == size
+                    digest = hashlib.sha256()
+                    await fetch_once(engine.session, url, sink=digest, cache=cache)
+                    assert digest.hexdigest() == hashlib.sha256(b'c' * size).hexdigest()
+
+            await engine.fetch(f"{base}/cache/500?cc=no-store", "Без кэширования")
+            assert f"{base}/cache/500?cc=no-store" not in cache.index
+
+            # Новое тело того же URL заменяет старый объект, а не оставляет его на диске
+            changing = f"{base}/cache/5000?cc=no-cache&changing=1"
+            for _ in range(9):
+                await engine.fetch(changing, "Меняющаяся страница")
+            assert cache.total_size() == sum({e['digest']: e['size'] for e in cache.index.values()}.values())
+            assert cache.total_size() <= cache.max_bytes
+
+            for size in (9000, 10000, 11000):
+                await engine.fetch(f"{base}/cache/{size}", f"Большая {size}")
+            assert cache.total_size() <= cache.max_bytes
+            assert fresh not in cache.index  # самая давняя запись вытеснена
+
+        reopened = HttpCache(directory)
+        assert reopened.index.keys() == cache.index.keys()
+    instrumentation.flush()
+    print(f"Проверка пройдена: попаданий {cache.hits}, перепроверок {cache.revalidations}, "
+          f"загрузок {cache.misses}")
+
+
+CHECKS = {
+    'local': check_scraper_local,
+    'stream': benchmark_streaming_memory,
+    'cache': check_http_cache,
+}
+
+
 # Запуск задачи
 if __name__ == "__main__":
-    asyncio.run(task4_async_scraper())
+    if len(sys.argv) > 1:
+        asyncio.run(CHECKS[sys.argv[1]]())
+    else:
+        asyncio.run(task4_async_scraper())
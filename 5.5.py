@@ -2,31 +2,67 @@ import time
 import threading
 import multiprocessing
 import asyncio
+import argparse
+import csv
+import json
+import math
+import os
+import resource
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import instrumentation
+from instrumentation import log, span
 
+
+@span('io_task')
 def io_task(name, duration):
     """I/O-bound задача"""
     time.sleep(duration)
-    print(f"{name} completed")
+    log(f"{name} completed", event='task.end', name=name, duration=duration)
     return f"{name} completed"
 
 
+@span('async_io_task')
 async def async_io_task(name, duration):
     """Асинхронная I/O-bound задача"""
     await asyncio.sleep(duration)
-    print(f"{name} completed")
+    log(f"{name} completed", event='task.end', name=name, duration=duration)
     return f"{name} completed"
 
 
 # Функция для многопроцессного выполнения (должна быть определена на верхнем уровне)
+@span('process_worker')
 def process_worker(name, duration):
     """Рабочая функция для процесса"""
     time.sleep(duration)
-    print(f"{name} completed")
+    log(f"{name} completed", event='task.end', name=name, duration=duration)
     return f"{name} completed"
 
 
-def task5_performance_comparison():
+def _worker_ready(ready_queue):
+    """Инициализатор процесса пула: сообщает, что процесс запущен"""
+    ready_queue.put(os.getpid())
+
+
+def start_process_pool(workers, start_method=None):
+    """
+    Создает пул процессов выбранным способом запуска (fork, forkserver, spawn)
+
+    Дожидается готовности всех процессов и возвращает (пул, время запуска),
+    чтобы стоимость старта измерялась отдельно от выполнения задач.
+    pid процессов сохраняются в pool.worker_pids.
+    """
+    context = multiprocessing.get_context(start_method)
+    ready_queue = context.Queue()
+    start_time = time.perf_counter()
+    pool = context.Pool(workers, initializer=_worker_ready, initargs=(ready_queue,))
+    pool.worker_pids = [ready_queue.get() for _ in range(workers)]
+    return pool, time.perf_counter() - start_time
+
+
+def task5_performance_comparison(start_method=None):
     """
     Задача: Сравните производительность разных подходов.
 
@@ -49,6 +85,7 @@ def task5_performance_comparison():
     sync_time = time.time() - start_time
 
     # 2. Многопоточное выполнение
+    instrumentation.flush()
     print("\n=== МНОГОПОТОЧНОЕ ВЫПОЛНЕНИЕ ===")
     start_time = time.time()
 
@@ -63,22 +100,23 @@ def task5_performance_comparison():
 
     thread_time = time.time() - start_time
 
-    # 3. Многопроцессное выполнение (используем process_worker чтобы избежать рекурсии)
+    # 3. Многопроцессное выполнение в пуле (используем process_worker чтобы избежать рекурсии)
+    instrumentation.flush()
     print("\n=== МНОГОПРОЦЕССНОЕ ВЫПОЛНЕНИЕ ===")
     start_time = time.time()
 
-    processes = []
-    for name, duration in tasks:
-        process = multiprocessing.Process(target=process_worker, args=(name, duration))
-        processes.append(process)
-        process.start()
-
-    for process in processes:
-        process.join()
+    # Пул создается один раз, его запуск измеряется отдельно от выполнения задач
+    pool, process_startup_time = start_process_pool(len(tasks), start_method)
+    steady_start = time.time()
+    process_results = pool.starmap(process_worker, tasks)
+    process_steady_time = time.time() - steady_start
+    pool.close()
+    pool.join()
 
     process_time = time.time() - start_time
 
     # 4. Асинхронное выполнение
+    instrumentation.flush()
     print("\n=== АСИНХРОННОЕ ВЫПОЛНЕНИЕ ===")
 
     async def run_async():
@@ -93,10 +131,13 @@ def task5_performance_comparison():
     async_time = time.time() - start_time
 
     # Анализ результатов
+    instrumentation.flush()
     print("\n=== АНАЛИЗ РЕЗУЛЬТАТОВ ===")
     print(f"Синхронное время: {sync_time:.2f} сек")
     print(f"Многопоточное время: {thread_time:.2f} сек")
-    print(f"Многопроцессное время: {process_time:.2f} сек")
+    print(f"Многопроцессное время: {process_time:.2f} сек "
+          f"(запуск пула {process_startup_time:.2f} сек, выполнение {process_steady_time:.2f} сек, "
+          f"результатов: {len(process_results)})")
     print(f"Асинхронное время: {async_time:.2f} сек")
 
     # Выводы
@@ -108,6 +149,387 @@ def task5_performance_comparison():
     print("4. Асинхронность наиболее эффективна для большого количества I/O операций")
 
 
+# === Набор бенчмарков исполнителей ===
+
+def io_work(duration):
+    """I/O-bound нагрузка без вывода: ожидание duration секунд"""
+    time.sleep(duration)
+    return duration
+
+
+def cpu_work(n):
+    """CPU-bound нагрузка: сумма квадратов до n"""
+    total = 0
+    for i in range(n):
+        total += i * i
+    return total
+
+
+def mixed_work(args):
+    """Смешанная нагрузка: ожидание, затем вычисления"""
+    duration, n = args
+    time.sleep(duration)
+    return cpu_work(n)
+
+
+async def async_io_work(duration):
+    await asyncio.sleep(duration)
+    return duration
+
+
+async def async_cpu_work(n):
+    return cpu_work(n)
+
+
+async def async_mixed_work(args):
+    duration, n = args
+    await asyncio.sleep(duration)
+    return cpu_work(n)
+
+
+# Нагрузка: (функция, корутина для asyncio, аргумент одной задачи)
+WORKLOADS = {
+    'io': (io_work, async_io_work, 0.001),
+    'cpu': (cpu_work, async_cpu_work, 20_000),
+    'mixed': (mixed_work, async_mixed_work, (0.001, 10_000)),
+}
+
+
+def run_sync(func, args, workers, latencies, start):
+    results = []
+    for arg in args:
+        results.append(func(arg))
+        latencies.append(time.perf_counter() - start)
+    return results
+
+
+def collect(results_iter, latencies, start):
+    """Собирает результаты по порядку, отмечая время получения каждого"""
+    results = []
+    for result in results_iter:
+        results.append(result)
+        latencies.append(time.perf_counter() - start)
+    return results
+
+
+def run_pool(executor_class, func, args, workers, latencies, start, chunksize=1):
+    with executor_class(max_workers=workers) as executor:
+        return collect(executor.map(func, args, chunksize=chunksize), latencies, start)
+
+
+def run_async(coroutine, args, latencies, start):
+    async def one(arg):
+        result = await coroutine(arg)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    async def main():
+        return await asyncio.gather(*(one(arg) for arg in args))
+
+    return asyncio.run(main())
+
+
+def run_executor(executor, workload, tasks, workers, pool=None):
+    """
+    Выполняет tasks задач нагрузки workload выбранным исполнителем
+
+    Возвращает (результаты, время завершения каждой задачи от старта).
+    Для пулов задержка считается по мере получения результатов в порядке задач.
+    Для 'process' нужен уже запущенный pool (start_process_pool): старт процессов
+    не должен попадать в замер.
+    """
+    func, coroutine, arg = WORKLOADS[workload]
+    args = [arg] * tasks
+    latencies = []
+    start = time.perf_counter()
+    if executor == 'sync':
+        results = run_sync(func, args, workers, latencies, start)
+    elif executor == 'thread':
+        results = run_pool(ThreadPoolExecutor, func, args, workers, latencies, start)
+    elif executor == 'process':
+        if pool is None:
+            raise ValueError("Для исполнителя process нужен запущенный пул процессов")
+        chunksize = max(1, tasks // (workers * 4))
+        results = collect(pool.imap(func, args, chunksize), latencies, start)
+    elif executor == 'async':
+        results = run_async(coroutine, args, latencies, start)
+    else:
+        raise ValueError(f"Неизвестный исполнитель: {executor}")
+    return results, latencies
+
+
+def percentile(values, q):
+    """Перцентиль по методу ближайшего ранга: наименьшее значение, которого не превышают не менее q% выборки"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Ранг ceil(q * n / 100): round() округлял бы половины к четному и занижал ранг,
+    # а q / 100 * n дает погрешность (0.07 * 100 = 7.000000000000001)
+    index = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered) / 100) - 1))
+    return ordered[index]
+
+
+def current_rss_kb():
+    """Текущий RSS процесса в КБ (Linux /proc, иначе пиковый ru_maxrss)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def cpu_seconds(pids=()):
+    """
+    Процессорное время (user + sys) процесса и завершенных дочерних процессов
+
+    pids - еще работающие процессы (пул между замерами не завершается), их время
+    читается из /proc/<pid>/stat.
+    """
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+
+def measure(executor, workload, tasks, workers=32, repeats=3, warmup=1):
+    """
+    Прогревочные и измеряемые запуски одной конфигурации; возвращает сводку
+
+    Пул процессов запускается один раз на конфигурацию до замеров; время его
+    запуска - отдельное поле pool_startup_seconds.
+    """
+    pool, pool_startup = start_process_pool(workers) if executor == 'process' else (None, 0.0)
+    try:
+        for _ in range(warmup):
+            run_executor(executor, workload, min(tasks, 100), workers, pool)
+
+        walls, cpus, rss, latencies = [], [], [], []
+        for _ in range(repeats):
+            rss_before = current_rss_kb()
+            worker_pids = pool.worker_pids if pool is not None else ()
+            cpu_before = cpu_seconds(worker_pids)
+            start = time.perf_counter()
+            _, run_latencies = run_executor(executor, workload, tasks, workers, pool)
+            walls.append(time.perf_counter() - start)
+            cpus.append(cpu_seconds(worker_pids) - cpu_before)
+            rss.append(current_rss_kb() - rss_before)
+            latencies.extend(run_latencies)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return {
+        'workload': workload,
+        'executor': executor,
+        'tasks': tasks,
+        'workers': workers,
+        'repeats': repeats,
+        'pool_startup_seconds': pool_startup,
+        'wall_mean': statistics.mean(walls),
+        'wall_min': min(walls),
+        'wall_p50': percentile(walls, 50),
+        'wall_p95': percentile(walls, 95),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p90': percentile(latencies, 90),
+        'latency_p99': percentile(latencies, 99),
+        'throughput': tasks / statistics.mean(walls),
+        'cpu_seconds': statistics.mean(cpus),
+        'rss_delta_kb': max(rss),
+        'rss_kb': current_rss_kb(),
+    }
+
+
+def run_benchmark_suite(workloads, executors, task_counts, workers=32, repeats=3, warmup=1):
+    results = []
+    for workload in workloads:
+        for tasks in task_counts:
+            for executor in executors:
+                row = measure(executor, workload, tasks, workers, repeats, warmup)
+                results.append(row)
+                print(f"{workload:>5} {executor:>7} {tasks:>6} задач: {row['wall_mean']:.3f} сек, "
+                      f"p99 задачи {row['latency_p99']:.3f} сек, {row['throughput']:.0f} задач/сек, "
+                      f"CPU {row['cpu_seconds']:.2f} сек, RSS {row['rss_delta_kb']:+d} КБ"
+                      + (f", старт пула {row['pool_startup_seconds']:.3f} сек" if executor == 'process' else ""))
+    return results
+
+
+def write_json(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def write_csv(results, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+class HybridExecutor:
+    """
+    Исполнитель для смешанных задач: I/O-этап на цикле asyncio,
+    CPU-этап в пуле процессов через run_in_executor
+
+    Между этапами - ограниченная очередь: если процессы не успевают,
+    I/O-этап приостанавливается и не копит готовые данные в памяти.
+    """
+
+    def __init__(self, processes=None, io_concurrency=100, queue_size=None, start_method=None):
+        self.processes = processes or os.cpu_count()
+        self.io_concurrency = io_concurrency
+        self.queue_size = queue_size or self.processes * 2
+        self.context = multiprocessing.get_context(start_method)
+        self.pool = None
+
+    def __enter__(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=self.context)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pool.shutdown()
+
+    async def run(self, io_func, cpu_func, args):
+        """
+        Для каждого arg: data = await io_func(arg), затем cpu_func(data) в процессе; результаты по порядку
+
+        Ошибка одной задачи не останавливает остальные: после обработки всех
+        аргументов run() выбрасывает первую по порядку аргументов ошибку.
+        """
+        loop = asyncio.get_running_loop()
+        stage = asyncio.Queue(maxsize=self.queue_size)
+        semaphore = asyncio.Semaphore(self.io_concurrency)
+        results = [None] * len(args)
+        errors = {}
+
+        async def io_stage(index, arg):
+            async with semaphore:
+                try:
+                    data = await io_func(arg)
+                except Exception as e:
+                    errors[index] = e
+                    return
+                # Ждет места в очереди, удерживая слот I/O: так работает обратное давление
+                await stage.put((index, data))
+
+        async def cpu_stage():
+            while True:
+                index, data = await stage.get()
+                try:
+                    results[index] = await loop.run_in_executor(self.pool, cpu_func, data)
+                except Exception as e:
+                    # Исключение не должно завершать потребителя, иначе очередь встанет
+                    errors[index] = e
+                finally:
+                    stage.task_done()
+
+        consumers = [asyncio.create_task(cpu_stage()) for _ in range(self.processes)]
+        try:
+            await asyncio.gather(*(io_stage(index, arg) for index, arg in enumerate(args)))
+            await stage.join()
+        finally:
+            for consumer in consumers:
+                consumer.cancel()
+        if errors:
+            raise errors[min(errors)]
+        return results
+
+
+async def async_fetch_work(args):
+    """I/O-часть смешанной задачи: ожидание, затем передача аргумента для вычислений"""
+    duration, n = args
+    await asyncio.sleep(duration)
+    return n
+
+
+def benchmark_hybrid(tasks=400, duration=0.02, n=50_000, threads=32):
+    """Смешанная нагрузка: пул потоков, пул процессов и HybridExecutor"""
+    args = [(duration, n)] * tasks
+    processes = os.cpu_count()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        thread_results = list(executor.map(mixed_work, args))
+    thread_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        process_results = list(executor.map(mixed_work, args))
+    process_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with HybridExecutor(processes=processes) as hybrid:
+        hybrid_results = asyncio.run(hybrid.run(async_fetch_work, cpu_work, args))
+        hybrid_time = time.perf_counter() - start_time
+
+        # Ошибки в нескольких задачах (больше, чем процессов) не должны подвешивать run()
+        broken = [(0, 10), (0, 'x'), (0, 10), (0, 'y')] * processes + [(0, 10)] * 10
+        try:
+            asyncio.run(asyncio.wait_for(hybrid.run(async_fetch_work, cpu_work, broken), timeout=30))
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("HybridExecutor.run не передал ошибку задачи")
+
+    assert thread_results == process_results == hybrid_results
+    print(f"Смешанная нагрузка: {tasks} задач (ожидание {duration} сек + cpu_work({n})), ядер: {processes}")
+    print(f"Пул потоков ({threads}): {thread_time:.2f} сек")
+    print(f"Пул процессов ({processes}): {process_time:.2f} сек")
+    print(f"HybridExecutor: {hybrid_time:.2f} сек")
+
+
+def compare_start_methods(tasks=200, workers=4, n=20_000):
+    """Стоимость запуска пула и установившаяся пропускная способность для каждого способа запуска"""
+    for start_method in multiprocessing.get_all_start_methods():
+        pool, startup = start_process_pool(workers, start_method)
+        with pool:
+            start_time = time.perf_counter()
+            results = pool.map(cpu_work, [n] * tasks, chunksize=max(1, tasks // (workers * 4)))
+            steady = time.perf_counter() - start_time
+        assert len(results) == tasks
+        print(f"{start_method:>10}: запуск {startup * 1000:.1f} мс, "
+              f"выполнение {steady:.3f} сек ({tasks / steady:.0f} задач/сек)")
+
+
+def benchmark_cli(argv):
+    parser = argparse.ArgumentParser(description="Сравнение исполнителей на разных нагрузках")
+    parser.add_argument('--workloads', default='io,cpu,mixed')
+    parser.add_argument('--executors', default='sync,thread,process,async')
+    parser.add_argument('--tasks', default='100,1000', help="числа задач через запятую (до 100000)")
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--json', help="путь для результатов в JSON")
+    parser.add_argument('--csv', help="путь для результатов в CSV")
+    options = parser.parse_args(argv)
+
+    results = run_benchmark_suite(
+        options.workloads.split(','), options.executors.split(','),
+        [int(n) for n in options.tasks.split(',')], options.workers, options.repeats, options.warmup
+    )
+    if options.json:
+        write_json(results, options.json)
+    if options.csv:
+        write_csv(results, options.csv)
+
+
 # Запуск задачи
 if __name__ == "__main__":
-    task5_performance_comparison()
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        benchmark_cli(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'startup':
+        compare_start_methods()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'hybrid':
+        benchmark_hybrid()
+    elif len(sys.argv) > 1:
+        task5_performance_comparison(start_method=sys.argv[1])
+    else:
+        task5_performance_comparison()
@@ -1,47 +1,156 @@
+import os
+import random
 import sqlite3
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import closing, contextmanager
 from datetime import datetime
 
+import instrumentation
+from dbtools import QueryCache, apply_migrations, explain_query_plans
+from instrumentation import log, span
+
 DB_PATH = 'university.db'
 
+# Легковесная строка студента: кортеж без словаря на каждый объект
+STUDENT_FIELDS = ('id', 'first_name', 'last_name', 'group_name', 'admission_year', 'average_grade', 'created_at')
+Student = namedtuple('Student', STUDENT_FIELDS)
+
+# Миграции схемы для dbtools.apply_migrations: (версия, список SQL-операторов)
+MIGRATIONS = [
+    (1, (
+        "CREATE INDEX IF NOT EXISTS idx_students_group ON students(group_name)",
+        # Первичный ключ (student_id, course_id) не помогает искать по курсу
+        "CREATE INDEX IF NOT EXISTS idx_student_courses_course ON student_courses(course_id)",
+    )),
+    (2, (
+        # Покрывающий индекс для средних по группам; idx_students_group остается для
+        # поиска и keyset-пагинации по группе (group_name, id)
+        "CREATE INDEX IF NOT EXISTS idx_students_group_grade ON students(group_name, average_grade)",
+        "CREATE INDEX IF NOT EXISTS idx_students_year ON students(admission_year)",
+    )),
+]
+
+# Необязательные сводные таблицы для аналитики (enable_summary_tables).
+# Триггеры обновляют их при каждом изменении, в том числе через
+# enroll_many, update_grades, transfer_student и delete_student
+SUMMARY_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS group_stats (
+        group_name TEXT PRIMARY KEY,
+        students INTEGER NOT NULL DEFAULT 0,
+        graded INTEGER NOT NULL DEFAULT 0,
+        grade_sum REAL NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS course_stats (
+        course_id INTEGER PRIMARY KEY,
+        students INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS student_credits (
+        student_id INTEGER PRIMARY KEY,
+        courses INTEGER NOT NULL DEFAULT 0,
+        credits INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS students_summary_insert AFTER INSERT ON students BEGIN
+        INSERT INTO group_stats (group_name, students, graded, grade_sum)
+        VALUES (new.group_name, 1, new.average_grade IS NOT NULL, COALESCE(new.average_grade, 0))
+        ON CONFLICT (group_name) DO UPDATE SET students = students + 1,
+            graded = graded + excluded.graded, grade_sum = grade_sum + excluded.grade_sum;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS students_summary_delete AFTER DELETE ON students BEGIN
+        UPDATE group_stats SET students = students - 1, graded = graded - (old.average_grade IS NOT NULL),
+            grade_sum = grade_sum - COALESCE(old.average_grade, 0)
+        WHERE group_name = old.group_name;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS students_summary_update AFTER UPDATE OF group_name, average_grade ON students
+    WHEN old.group_name IS NOT new.group_name OR old.average_grade IS NOT new.average_grade BEGIN
+        UPDATE group_stats SET students = students - 1, graded = graded - (old.average_grade IS NOT NULL),
+            grade_sum = grade_sum - COALESCE(old.average_grade, 0)
+        WHERE group_name = old.group_name;
+        INSERT INTO group_stats (group_name, students, graded, grade_sum)
+        VALUES (new.group_name, 1, new.average_grade IS NOT NULL, COALESCE(new.average_grade, 0))
+        ON CONFLICT (group_name) DO UPDATE SET students = students + 1,
+            graded = graded + excluded.graded, grade_sum = grade_sum + excluded.grade_sum;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_courses_summary_insert AFTER INSERT ON student_courses BEGIN
+        INSERT INTO course_stats (course_id, students) VALUES (new.course_id, 1)
+        ON CONFLICT (course_id) DO UPDATE SET students = students + 1;
+        INSERT INTO student_credits (student_id, courses, credits)
+        VALUES (new.student_id, 1, COALESCE((SELECT credits FROM courses WHERE id = new.course_id), 0))
+        ON CONFLICT (student_id) DO UPDATE SET courses = courses + 1, credits = credits + excluded.credits;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS student_courses_summary_delete AFTER DELETE ON student_courses BEGIN
+        UPDATE course_stats SET students = students - 1 WHERE course_id = old.course_id;
+        UPDATE student_credits SET courses = courses - 1,
+            credits = credits - COALESCE((SELECT credits FROM courses WHERE id = old.course_id), 0)
+        WHERE student_id = old.student_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS courses_summary_credits AFTER UPDATE OF credits ON courses
+    WHEN old.credits IS NOT new.credits BEGIN
+        UPDATE student_credits SET credits = credits + new.credits - old.credits
+        WHERE student_id IN (SELECT student_id FROM student_courses WHERE course_id = new.id);
+    END""",
+)
+SUMMARY_TABLES = ('group_stats', 'course_stats', 'student_credits')
+SUMMARY_TRIGGERS = ('students_summary_insert', 'students_summary_delete', 'students_summary_update',
+                    'student_courses_summary_insert', 'student_courses_summary_delete', 'courses_summary_credits')
+
+#  Кэш чтения 
+# Кэш get_student_courses; ключ - (файл базы, student_id). Записи студента
+# сбрасываются при его зачислении, переводе и удалении
+COURSE_CACHE = QueryCache(max_entries=4096, ttl=60.0, name='student_courses')
+
+def _invalidate_student_courses(student_ids):
+    if COURSE_CACHE is not None:
+        for student_id in student_ids:
+            COURSE_CACHE.discard((DB_PATH, student_id))
+
 #  Создание базы и таблиц 
 def init_db():
     try:
         with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS students (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    first_name TEXT NOT NULL,
-                    last_name TEXT NOT NULL,
-                    group_name TEXT NOT NULL,
-                    admission_year INTEGER NOT NULL,
-                    average_grade REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS courses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    course_name TEXT UNIQUE NOT NULL,
-                    instructor TEXT NOT NULL,
-                    credits INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS student_courses (
-                    student_id INTEGER NOT NULL,
-                    course_id INTEGER NOT NULL,
-                    PRIMARY KEY (student_id, course_id),
-                    FOREIGN KEY (student_id) REFERENCES students(id),
-                    FOREIGN KEY (course_id) REFERENCES courses(id)
-                )
-            """)
+            create_schema(conn)
             print("База данных и таблицы созданы")
     except sqlite3.Error as e:
         print(f"Ошибка инициализации БД: {e}")
 
+def create_schema(conn):
+    """Создать таблицы и применить миграции на открытом соединении"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            admission_year INTEGER NOT NULL,
+            average_grade REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_name TEXT UNIQUE NOT NULL,
+            instructor TEXT NOT NULL,
+            credits INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS student_courses (
+            student_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            PRIMARY KEY (student_id, course_id),
+            FOREIGN KEY (student_id) REFERENCES students(id),
+            FOREIGN KEY (course_id) REFERENCES courses(id)
+        )
+    """)
+    apply_migrations(conn, MIGRATIONS)
+
 #  CRUD студенты 
+@span('add_student')
 def add_student(first_name, last_name, group_name, admission_year, average_grade=None):
     try:
         with sqlite3.connect(DB_PATH) as conn:
@@ -52,9 +161,10 @@ def add_student(first_name, last_name, group_name, admission_year, average_grade
             """, (first_name, last_name, group_name, admission_year, average_grade))
             return cursor.lastrowid
     except sqlite3.Error as e:
-        print(f"Ошибка добавления студента: {e}")
+        log(f"Ошибка добавления студента: {e}", event='student.error', error=str(e))
         return None
 
+@span('get_all_students')
 def get_all_students():
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
@@ -62,30 +172,63 @@ def get_all_students():
         cursor.execute("SELECT * FROM students")
         return [dict(row) for row in cursor.fetchall()]
 
+@span('get_students_by_group')
 def get_students_by_group(group_name):
     with sqlite3.connect(DB_PATH) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM students WHERE group_name = ?", (group_name,))
+        # ORDER BY id: порядок по id и выбор idx_students_group, а не индекса по оценкам
+        cursor.execute("SELECT * FROM students WHERE group_name = ? ORDER BY id", (group_name,))
         return [dict(row) for row in cursor.fetchall()]
 
+def iter_students(group_name=None, after_id=0, limit=None, batch_size=1000):
+    """Потоково отдавать студентов (Student) по возрастанию id, начиная после after_id.
+
+    Keyset-пагинация: каждая порция — запрос WHERE id > ? ORDER BY id LIMIT ?,
+    поэтому в памяти одновременно не больше batch_size строк.
+    """
+    query = f"SELECT {', '.join(STUDENT_FIELDS)} FROM students WHERE id > ?"
+    if group_name is not None:
+        query += " AND group_name = ?"
+    query += " ORDER BY id LIMIT ?"
+    remaining = limit
+    with closing(sqlite3.connect(DB_PATH)) as conn:
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            params = (after_id, group_name, size) if group_name is not None else (after_id, size)
+            rows = conn.execute(query, params).fetchall()
+            yield from map(Student._make, rows)
+            if len(rows) < size:
+                return
+            after_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+def iter_students_by_group(group_name, after_id=0, limit=None, batch_size=1000):
+    """Потоковый вариант get_students_by_group с keyset-пагинацией"""
+    return iter_students(group_name, after_id, limit, batch_size)
+
+@span('update_student_grade')
 def update_student_grade(student_id, new_grade):
     try:
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute("UPDATE students SET average_grade = ? WHERE id = ?", (new_grade, student_id))
     except sqlite3.Error as e:
-        print(f"Ошибка обновления оценки: {e}")
+        log(f"Ошибка обновления оценки: {e}", event='grade.error', error=str(e))
 
+@span('delete_student')
 def delete_student(student_id):
     try:
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM students WHERE id = ?", (student_id,))
+        _invalidate_student_courses([student_id])
     except sqlite3.Error as e:
-        print(f"Ошибка удаления студента: {e}")
+        log(f"Ошибка удаления студента: {e}", event='student.delete_error', error=str(e))
 
 #  CRUD курсы 
+@span('add_course')
 def add_course(course_name, instructor, credits):
     try:
         with sqlite3.connect(DB_PATH) as conn:
@@ -94,32 +237,70 @@ def add_course(course_name, instructor, credits):
                            (course_name, instructor, credits))
             return cursor.lastrowid
     except sqlite3.Error as e:
-        print(f"Ошибка добавления курса: {e}")
+        log(f"Ошибка добавления курса: {e}", event='course.error', error=str(e))
         return None
 
+@span('enroll_student_in_course')
 def enroll_student_in_course(student_id, course_id):
     try:
         with sqlite3.connect(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)",
                            (student_id, course_id))
+        _invalidate_student_courses([student_id])
     except sqlite3.IntegrityError:
         pass  # студент уже зачислен
     except sqlite3.Error as e:
-        print(f"Ошибка зачисления на курс: {e}")
+        log(f"Ошибка зачисления на курс: {e}", event='enroll.error', error=str(e))
+
+@span('enroll_many')
+def enroll_many(pairs):
+    """Зачислить пачку (student_id, course_id) одной транзакцией; уже зачисленные пропускаются"""
+    pairs = list(pairs)
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO student_courses (student_id, course_id) VALUES (?, ?)", pairs
+            )
+            inserted = max(cursor.rowcount, 0)
+        _invalidate_student_courses({student_id for student_id, _ in pairs})
+        return {'inserted': inserted, 'skipped': len(pairs) - inserted}
+    except sqlite3.Error as e:
+        log(f"Ошибка зачисления на курсы: {e}", event='enroll.error', error=str(e))
+        return {'inserted': 0, 'skipped': len(pairs)}
+
+@span('update_grades')
+def update_grades(grades):
+    """Обновить средние баллы по словарю {student_id: grade} одной транзакцией"""
+    rows = [(grade, student_id) for student_id, grade in dict(grades).items()]
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            cursor = conn.executemany("UPDATE students SET average_grade = ? WHERE id = ?", rows)
+            updated = max(cursor.rowcount, 0)
+            return {'updated': updated, 'skipped': len(rows) - updated}
+    except sqlite3.Error as e:
+        log(f"Ошибка обновления оценок: {e}", event='grade.error', error=str(e))
+        return {'updated': 0, 'skipped': len(rows)}
 
+@span('get_student_courses')
 def get_student_courses(student_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT c.id, c.course_name, c.instructor
-            FROM courses c
-            JOIN student_courses sc ON c.id = sc.course_id
-            WHERE sc.student_id = ?
-        """, (student_id,))
-        return [dict(row) for row in cursor.fetchall()]
+    def load():
+        with closing(sqlite3.connect(DB_PATH)) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT c.id, c.course_name, c.instructor
+                FROM courses c
+                JOIN student_courses sc ON c.id = sc.course_id
+                WHERE sc.student_id = ?
+            """, (student_id,))
+            return [dict(row) for row in cursor.fetchall()]
+
+    if COURSE_CACHE is None:
+        return load()
+    return COURSE_CACHE.get_or_load((DB_PATH, student_id), load)
 
+@span('transfer_student')
 def transfer_student(student_id, new_group):
     try:
         with sqlite3.connect(DB_PATH) as conn:
@@ -128,14 +309,416 @@ def transfer_student(student_id, new_group):
             cursor.execute("UPDATE students SET group_name = ? WHERE id = ?", (new_group, student_id))
             cursor.execute("DELETE FROM student_courses WHERE student_id = ?", (student_id,))
             conn.commit()
+        _invalidate_student_courses([student_id])
     except sqlite3.Error as e:
         conn.rollback()
-        print(f"Ошибка перевода студента: {e}")
+        log(f"Ошибка перевода студента: {e}", event='transfer.error', error=str(e))
+
+#  Аналитика 
+# Каждый отчет: прямой агрегатный запрос по индексам (live) и чтение сводной
+# таблицы (summary); для каждого - (SQL, условие отбора по одному ключу)
+ANALYTICS_QUERIES = {
+    'group_statistics': {
+        'live': ("""SELECT group_name, COUNT(*) AS students, COUNT(average_grade) AS graded,
+                        AVG(average_grade) AS average_grade
+                    FROM students {filter} GROUP BY group_name ORDER BY group_name""",
+                 "WHERE group_name = ?"),
+        'summary': ("""SELECT group_name, students, graded,
+                           CASE WHEN graded > 0 THEN grade_sum / graded END AS average_grade
+                       FROM group_stats WHERE students > 0 {filter} ORDER BY group_name""",
+                    "AND group_name = ?"),
+    },
+    'course_enrollment_counts': {
+        'live': ("""SELECT c.id AS course_id, c.course_name, COUNT(sc.course_id) AS students
+                    FROM courses c LEFT JOIN student_courses sc ON sc.course_id = c.id
+                    {filter} GROUP BY c.id ORDER BY c.id""",
+                 "WHERE c.id = ?"),
+        'summary': ("""SELECT c.id AS course_id, c.course_name, COALESCE(s.students, 0) AS students
+                       FROM courses c LEFT JOIN course_stats s ON s.course_id = c.id
+                       {filter} ORDER BY c.id""",
+                    "WHERE c.id = ?"),
+    },
+    'student_credit_totals': {
+        'live': ("""SELECT sc.student_id, COUNT(*) AS courses, SUM(c.credits) AS credits
+                    FROM student_courses sc JOIN courses c ON c.id = sc.course_id
+                    {filter} GROUP BY sc.student_id ORDER BY sc.student_id""",
+                 "WHERE sc.student_id = ?"),
+        'summary': ("""SELECT student_id, courses, credits
+                       FROM student_credits WHERE courses > 0 {filter} ORDER BY student_id""",
+                    "AND student_id = ?"),
+    },
+}
+
+def summary_tables_enabled(conn):
+    count = conn.execute(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join('?' * len(SUMMARY_TABLES))})",
+        SUMMARY_TABLES
+    ).fetchone()[0]
+    return count == len(SUMMARY_TABLES)
+
+def enable_summary_tables():
+    """Создать сводные таблицы с триггерами и заполнить их по текущим данным"""
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if summary_tables_enabled(conn):
+            return
+        for statement in SUMMARY_SCHEMA:
+            conn.execute(statement)
+        _fill_summary_tables(conn)
+
+def disable_summary_tables():
+    """Удалить сводные таблицы и триггеры: аналитика снова считает агрегаты по исходным таблицам"""
+    with sqlite3.connect(DB_PATH) as conn:
+        for trigger in SUMMARY_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        for table in SUMMARY_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+def _fill_summary_tables(conn):
+    for table in SUMMARY_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    conn.execute("""
+        INSERT INTO group_stats (group_name, students, graded, grade_sum)
+        SELECT group_name, COUNT(*), COUNT(average_grade), COALESCE(SUM(average_grade), 0)
+        FROM students GROUP BY group_name
+    """)
+    conn.execute("""
+        INSERT INTO course_stats (course_id, students)
+        SELECT course_id, COUNT(*) FROM student_courses GROUP BY course_id
+    """)
+    conn.execute("""
+        INSERT INTO student_credits (student_id, courses, credits)
+        SELECT sc.student_id, COUNT(*), COALESCE(SUM(c.credits), 0)
+        FROM student_courses sc LEFT JOIN courses c ON c.id = sc.course_id
+        GROUP BY sc.student_id
+    """)
+
+def _analytics(name, key=None, use_summary=None):
+    """Выполнить отчет name; use_summary=None - сводные таблицы, если они включены"""
+    with closing(sqlite3.connect(DB_PATH)) as conn:
+        conn.row_factory = sqlite3.Row
+        if use_summary is None:
+            use_summary = summary_tables_enabled(conn)
+        query, key_filter = ANALYTICS_QUERIES[name]['summary' if use_summary else 'live']
+        if key is None:
+            cursor = conn.execute(query.format(filter=''))
+        else:
+            cursor = conn.execute(query.format(filter=key_filter), (key,))
+        return [dict(row) for row in cursor]
+
+@span('group_statistics')
+def group_statistics(group_name=None, use_summary=None):
+    """Число студентов, число с оценкой и средний балл по группам (или по одной группе)"""
+    return _analytics('group_statistics', group_name, use_summary)
+
+@span('course_enrollment_counts')
+def course_enrollment_counts(course_id=None, use_summary=None):
+    """Число зачисленных студентов по курсам, включая курсы без студентов"""
+    return _analytics('course_enrollment_counts', course_id, use_summary)
+
+@span('student_credit_totals')
+def student_credit_totals(student_id=None, use_summary=None):
+    """Число курсов и сумма кредитов по студентам (только студенты с курсами)"""
+    return _analytics('student_credit_totals', student_id, use_summary)
+
+@span('admission_year_counts')
+def admission_year_counts():
+    """Число студентов по годам поступления (по индексу idx_students_year)"""
+    with closing(sqlite3.connect(DB_PATH)) as conn:
+        return dict(conn.execute(
+            "SELECT admission_year, COUNT(*) FROM students GROUP BY admission_year ORDER BY admission_year"
+        ).fetchall())
+
+def check_summary_tables():
+    """Сравнить сводные таблицы с прямым подсчетом; возвращает список расхождений"""
+    mismatches = []
+    for name in ANALYTICS_QUERIES:
+        live = _analytics(name, use_summary=False)
+        summary = _analytics(name, use_summary=True)
+        if len(live) != len(summary):
+            mismatches.append((name, len(live), len(summary)))
+            continue
+        for expected, actual in zip(live, summary):
+            for field, value in expected.items():
+                other = actual[field]
+                if isinstance(value, float) or isinstance(other, float):
+                    same = value is not None and other is not None and abs(value - other) < 1e-6
+                    same = same or (value is None and other is None)
+                else:
+                    same = value == other
+                if not same:
+                    mismatches.append((name, expected, actual))
+                    break
+    return mismatches
+
+#  Бенчмарки 
+@contextmanager
+def _bench_db(db_path):
+    """Временно направить все функции модуля на отдельную базу"""
+    global DB_PATH
+    previous = DB_PATH
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    DB_PATH = db_path
+    try:
+        with sqlite3.connect(db_path) as conn:
+            create_schema(conn)
+        yield db_path
+    finally:
+        DB_PATH = previous
+        os.remove(db_path)
+
+def benchmark_student_streaming(rows=1_000_000):
+    """Пиковая память и время до первой строки: get_all_students против iter_students"""
+    with _bench_db('university_stream.db'):
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.executemany(
+                "INSERT INTO students (first_name, last_name, group_name, admission_year) VALUES (?, ?, ?, ?)",
+                ((f"Имя {i}", f"Фамилия {i}", f"Группа {i % 2000}", 2015 + i % 10) for i in range(rows))
+            )
+        for name, source in (("get_all_students", get_all_students), ("iter_students", iter_students)):
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            first_row_time = None
+            count = 0
+            for _ in source():
+                if first_row_time is None:
+                    first_row_time = time.perf_counter() - start_time
+                count += 1
+            total_time = time.perf_counter() - start_time
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name}: {count} строк, пик памяти {peak / 2**20:.1f} МБ, "
+                  f"первая строка через {first_row_time * 1000:.1f} мс, всего {total_time:.2f} сек")
+
+def benchmark_batch_enrollment(students=20_000, courses=50, per_student=3, single_calls=2000):
+    """Зачисление по одной записи (enroll_student_in_course) против enroll_many"""
+    with _bench_db('university_enroll.db'):
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.executemany(
+                "INSERT INTO students (first_name, last_name, group_name, admission_year) VALUES (?, ?, ?, ?)",
+                ((f"Имя {i}", f"Фамилия {i}", f"Группа {i % 100}", 2024) for i in range(students))
+            )
+            conn.executemany(
+                "INSERT INTO courses (course_name, instructor, credits) VALUES (?, ?, ?)",
+                ((f"Курс {i}", "Преподаватель", 3) for i in range(courses))
+            )
+        pairs = [(s + 1, (s * 7 + k) % courses + 1) for s in range(students) for k in range(per_student)]
+
+        start_time = time.perf_counter()
+        for student_id, course_id in pairs[:single_calls]:
+            enroll_student_in_course(student_id, course_id)
+        single_rate = single_calls / (time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        result = enroll_many(pairs)
+        batch_rate = len(pairs) / (time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        grades = update_grades({s + 1: 3.0 + s % 20 / 10 for s in range(students)})
+        grade_rate = students / (time.perf_counter() - start_time)
+
+    print(f"enroll_student_in_course: {single_rate:.0f} зачислений/сек")
+    print(f"enroll_many: {batch_rate:.0f} зачислений/сек, {result}")
+    print(f"update_grades: {grade_rate:.0f} обновлений/сек, {grades}")
+
+def benchmark_course_cache(students=2000, courses=50, operations=20000, write_ratio=0.05, seed=7):
+    """get_student_courses под нагрузкой с преобладанием чтения: без кэша против COURSE_CACHE"""
+    global COURSE_CACHE
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(operations):
+        student_id = rng.randint(1, students)
+        if rng.random() < write_ratio:
+            workload.append(('transfer' if rng.random() < 0.2 else 'enroll', student_id, rng.randint(1, courses)))
+        else:
+            workload.append(('read', student_id, None))
+
+    def run():
+        with _bench_db('university_cache.db'):
+            with sqlite3.connect(DB_PATH) as conn:
+                conn.executemany(
+                    "INSERT INTO students (first_name, last_name, group_name, admission_year) VALUES (?, ?, ?, ?)",
+                    ((f"Имя {i}", f"Фамилия {i}", f"Группа {i % 100}", 2024) for i in range(students))
+                )
+                conn.executemany(
+                    "INSERT INTO courses (course_name, instructor, credits) VALUES (?, ?, ?)",
+                    ((f"Курс {i}", "Преподаватель", 3) for i in range(courses))
+                )
+            enroll_many((s + 1, (s * 7 + k) % courses + 1) for s in range(students) for k in range(3))
+            digests = []
+            start_time = time.perf_counter()
+            for op, student_id, course_id in workload:
+                if op == 'read':
+                    digests.append(tuple(row['id'] for row in get_student_courses(student_id)))
+                elif op == 'enroll':
+                    enroll_student_in_course(student_id, course_id)
+                else:
+                    transfer_student(student_id, f"Группа {course_id}")
+            return time.perf_counter() - start_time, digests
+
+    previous = COURSE_CACHE
+    try:
+        COURSE_CACHE = None
+        plain_time, plain_digests = run()
+        COURSE_CACHE = QueryCache(max_entries=4096, ttl=60.0, name='student_courses')
+        cached_time, cached_digests = run()
+        stats = COURSE_CACHE.stats()
+    finally:
+        COURSE_CACHE = previous
+    assert plain_digests == cached_digests, "кэш вернул устаревшие данные"
+
+    print(f"Операций: {operations}, из них записей: {write_ratio:.0%}")
+    print(f"Без кэша: {operations / plain_time:.0f} ops/sec")
+    print(f"QueryCache: {operations / cached_time:.0f} ops/sec, попаданий {stats['hit_rate']:.1%}, "
+          f"инвалидаций {stats['invalidations']}, вытеснений {stats['evictions']}")
+    print(f"Ускорение: {plain_time / cached_time:.2f}x, результаты совпадают")
+
+def _python_group_statistics():
+    """Прежний способ: все студенты в Python и подсчет в цикле"""
+    groups = {}
+    for student in get_all_students():
+        stats = groups.setdefault(student['group_name'], [0, 0, 0.0])
+        stats[0] += 1
+        if student['average_grade'] is not None:
+            stats[1] += 1
+            stats[2] += student['average_grade']
+    return {name: (count, graded, total / graded if graded else None)
+            for name, (count, graded, total) in groups.items()}
+
+def benchmark_analytics(students=200_000, courses=200, per_student=3, updates=2000, seed=5):
+    """Статистика по группам: Python против SQL-агрегата и сводных таблиц; согласованность сводок"""
+    rng = random.Random(seed)
+    with _bench_db('university_analytics.db'):
+        with sqlite3.connect(DB_PATH) as conn:
+            conn.executemany(
+                "INSERT INTO students (first_name, last_name, group_name, admission_year, average_grade) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((f"Имя {i}", f"Фамилия {i}", f"Группа {i % 500}", 2015 + i % 10,
+                  None if i % 17 == 0 else round(rng.uniform(2, 5), 2)) for i in range(students))
+            )
+            conn.executemany(
+                "INSERT INTO courses (course_name, instructor, credits) VALUES (?, ?, ?)",
+                ((f"Курс {i}", "Преподаватель", 2 + i % 5) for i in range(courses))
+            )
+        enroll_many((s + 1, rng.randint(1, courses)) for s in range(students) for _ in range(per_student))
+
+        timings = {}
+        start_time = time.perf_counter()
+        expected = _python_group_statistics()
+        timings['Python (get_all_students)'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        live = group_statistics()
+        timings['SQL-агрегат'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        enable_summary_tables()
+        enable_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        summary = group_statistics()
+        timings['Сводная таблица'] = time.perf_counter() - start_time
+
+        for rows in (live, summary):
+            assert len(rows) == len(expected)
+            for row in rows:
+                count, graded, average = expected[row['group_name']]
+                assert (row['students'], row['graded']) == (count, graded)
+                assert abs(row['average_grade'] - average) < 1e-6
+
+        # Изменения через все функции записи поддерживают сводки в актуальном состоянии
+        start_time = time.perf_counter()
+        with instrumentation.quiet():
+            for i in range(updates):
+                student_id = rng.randint(1, students)
+                action = i % 6
+                if action == 0:
+                    add_student("Новый", "Студент", f"Группа {rng.randint(0, 550)}", 2025, rng.choice([None, 4.5]))
+                elif action == 1:
+                    update_student_grade(student_id, rng.choice([None, round(rng.uniform(2, 5), 2)]))
+                elif action == 2:
+                    enroll_student_in_course(student_id, rng.randint(1, courses))
+                elif action == 3:
+                    transfer_student(student_id, f"Группа {rng.randint(0, 550)}")
+                elif action == 4:
+                    update_grades({rng.randint(1, students): 3.5 for _ in range(10)})
+                else:
+                    delete_student(student_id)
+        update_time = time.perf_counter() - start_time
+        mismatches = check_summary_tables()
+        assert not mismatches, mismatches[:3]
+
+        for name, report in (("course_enrollment_counts", course_enrollment_counts),
+                             ("student_credit_totals", student_credit_totals)):
+            for use_summary in (False, True):
+                start_time = time.perf_counter()
+                rows = report(use_summary=use_summary)
+                label = f"{name} ({'сводка' if use_summary else 'SQL'})"
+                timings[label] = time.perf_counter() - start_time
+        disable_summary_tables()
+        assert group_statistics() == group_statistics(use_summary=False)
+
+    for name, elapsed in timings.items():
+        print(f"{name}: {elapsed * 1000:.1f} мс")
+    print(f"Создание сводных таблиц: {enable_time:.2f} сек, {updates} изменений со сводками: "
+          f"{update_time:.2f} сек")
+    print(f"Проверка пройдена: сводные таблицы совпадают с прямым подсчетом ({len(rows)} студентов с курсами)")
+
+#  Проверка планов запросов 
+HOT_QUERIES = [
+    ("get_students_by_group", "SELECT * FROM students WHERE group_name = ? ORDER BY id",
+     ('Группа 1',), 'INDEX idx_students_group (group_name=?)'),
+    ("iter_students_by_group",
+     f"SELECT {', '.join(STUDENT_FIELDS)} FROM students WHERE id > ? AND group_name = ? ORDER BY id LIMIT ?",
+     (0, 'Группа 1', 1000), 'INDEX idx_students_group (group_name=? AND rowid>?)'),
+    ("get_student_courses", """
+        SELECT c.id, c.course_name, c.instructor
+        FROM courses c
+        JOIN student_courses sc ON c.id = sc.course_id
+        WHERE sc.student_id = ?
+    """, (1,), 'sqlite_autoindex_student_courses_1'),
+    ("group_statistics", ANALYTICS_QUERIES['group_statistics']['live'][0].format(filter=''),
+     (), 'COVERING INDEX idx_students_group_grade'),
+    ("course_enrollment_counts", ANALYTICS_QUERIES['course_enrollment_counts']['live'][0].format(filter=''),
+     (), 'COVERING INDEX idx_student_courses_course'),
+    ("student_credit_totals", ANALYTICS_QUERIES['student_credit_totals']['live'][0].format(filter=''),
+     (), 'sqlite_autoindex_student_courses_1'),
+    ("admission_year_counts", "SELECT admission_year, COUNT(*) FROM students GROUP BY admission_year",
+     (), 'COVERING INDEX idx_students_year'),
+]
+
+def check_query_plans(db_path='university_plans.db', rows=1_000_000):
+    """Проверить через EXPLAIN QUERY PLAN, что горячие запросы используют индексы"""
+    # _bench_db создает схему и удаляет базу и при ошибке
+    with _bench_db(db_path), closing(sqlite3.connect(db_path)) as conn:
+        conn.executemany(
+            "INSERT INTO students (first_name, last_name, group_name, admission_year) VALUES (?, ?, ?, ?)",
+            ((f"Имя {i}", f"Фамилия {i}", f"Группа {i % 2000}", 2015 + i % 10) for i in range(rows))
+        )
+        conn.executemany(
+            "INSERT INTO courses (course_name, instructor, credits) VALUES (?, ?, ?)",
+            ((f"Курс {i}", f"Преподаватель {i % 50}", 2 + i % 5) for i in range(500))
+        )
+        conn.executemany(
+            "INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)",
+            ((i + 1, i % 500 + 1) for i in range(rows))
+        )
+        failed = explain_query_plans(conn, HOT_QUERIES)
+    assert not failed, f"Запросы без индекса: {failed}"
+
+BENCHMARKS = {
+    'plans': check_query_plans,
+    'stream': benchmark_student_streaming,
+    'enroll': benchmark_batch_enrollment,
+    'cache': benchmark_course_cache,
+    'analytics': benchmark_analytics,
+}
 
 #  Консольный интерфейс 
 def main_menu():
     init_db()
     while True:
+        instrumentation.flush()
         print("\n=== Университетский учет ===")
         print("1. Добавить студента")
         print("2. Просмотреть всех студентов")
@@ -146,6 +729,7 @@ def main_menu():
         print("7. Зачислить студента на курс")
         print("8. Показать курсы студента")
         print("9. Перевести студента в другую группу")
+        print("10. Статистика по группам и курсам")
         print("0. Выход")
         choice = input("Выберите действие: ")
 
@@ -156,11 +740,11 @@ def main_menu():
             admission_year = int(input("Год поступления: "))
             add_student(first_name, last_name, group_name, admission_year)
         elif choice == '2':
-            for s in get_all_students():
+            for s in iter_students():
                 print(s)
         elif choice == '3':
             group = input("Группа: ")
-            for s in get_students_by_group(group):
+            for s in iter_students_by_group(group):
                 print(s)
         elif choice == '4':
             student_id = int(input("ID студента: "))
@@ -186,10 +770,18 @@ def main_menu():
             student_id = int(input("ID студента: "))
             new_group = input("Новая группа: ")
             transfer_student(student_id, new_group)
+        elif choice == '10':
+            for row in group_statistics():
+                print(row)
+            for row in course_enrollment_counts():
+                print(row)
         elif choice == '0':
             break
         else:
             print("Неверный выбор!")
 
 if __name__ == "__main__":
-    main_menu()
+    if len(sys.argv) > 1:
+        BENCHMARKS[sys.argv[1]]()
+    else:
+        main_menu()
@@ -0,0 +1,134 @@
+"""
+Общие инструменты для баз SQLite задач
+
+- apply_migrations применяет миграции схемы: список (версия, SQL-операторы),
+  номер последней примененной версии хранится в PRAGMA user_version, поэтому
+  каждая миграция выполняется один раз;
+- explain_query_plans проверяет через EXPLAIN QUERY PLAN, что горячие запросы
+  ищут по ожидаемым индексам (SEARCH или COVERING INDEX, а не перебор индекса);
+- QueryCache кэширует результаты чтения в памяти процесса (TTL + LRU).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import metrics
+
+
+def apply_migrations(conn, migrations):
+    """Применить в одной транзакции миграции новее текущей PRAGMA user_version"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if all(target <= version for target, _ in migrations):
+        return version
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    # Версия перечитывается под блокировкой на запись: другой процесс мог применить
+    # миграции, пока этот ждал BEGIN IMMEDIATE
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    pending = [(target, statements) for target, statements in migrations if target > version]
+    if not pending:
+        return version
+    for target, statements in pending:
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {int(target)}")
+    return pending[-1][0]
+
+
+def explain_query_plans(conn, queries):
+    """
+    Печатает план каждого запроса (имя, SQL, параметры, ожидаемый фрагмент плана)
+
+    Фрагмент засчитывается только в шаге SEARCH или с COVERING INDEX: "SCAN t USING
+    INDEX i" читает весь индекс и обычно медленнее прохода по самой таблице.
+    Возвращает имена запросов, в плане которых нет такого шага.
+    """
+    failed = []
+    for name, query, params, expected in queries:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        ok = any(expected in detail and (detail.startswith('SEARCH') or 'COVERING INDEX' in detail)
+                 for detail in plan)
+        print(f"{'OK ' if ok else 'FAIL'} {name}: {'; '.join(plan)}")
+        if not ok:
+            failed.append(name)
+    return failed
+
+
+class QueryCache:
+    """Кэш результатов чтения в памяти процесса: TTL + вытеснение давно не использованных (LRU)
+
+    Ключ - (имя запроса, параметры), значение - список строк (dict). Запись
+    удаляется по истечении ttl, при переполнении или явной инвалидацией.
+    Инвалидация увеличивает generation: результат, загруженный из базы во время
+    инвалидации, в кэш уже не попадет и не перезапишет свежие данные старыми.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30.0, name='library'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # ключ -> (срок годности, кортеж строк)
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        """Вернуть строки из кэша или загрузить их через load() и сохранить"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                rows = entry[1]
+            else:
+                self.misses += 1
+                rows = None
+                generation = self.generation
+        metrics.inc('query_cache_requests_total', cache=self.name, result='miss' if rows is None else 'hit')
+        if rows is not None:
+            # Копии строк: вызывающий код может менять результат, не портя кэш
+            return [dict(row) for row in rows]
+
+        rows = load()
+        with self._lock:
+            if self.generation == generation:
+                self._entries[key] = (now + self.ttl, tuple(dict(row) for row in rows))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return rows
+
+    def discard(self, key):
+        """Удалить одну запись"""
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate(self, predicate):
+        """Удалить все записи, ключ которых удовлетворяет predicate(key)"""
+        with self._lock:
+            self.generation += 1
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        self.invalidate(lambda key: True)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,290 @@
+"""
+Общая инструментовка задач: структурные логи, замер времени и метрики
+
+- log() не пишет в stdout сам, а кладет запись в очередь; печатает ее отдельный
+  поток (QueueListener), поэтому рабочие потоки не ждут друг друга на выводе;
+- @span замеряет время вызова монотонными часами (perf_counter) и считает вызовы,
+  ошибки и гистограмму длительностей;
+- метрики выгружаются в JSON или текстовом формате Prometheus;
+- TASKS_INSTRUMENTATION=0 отключает все: span возвращает функцию без обертки,
+  log ничего не делает, metrics.inc и metrics.observe не берут блокировку.
+
+Переменные окружения:
+TASKS_INSTRUMENTATION=0 - отключить инструментовку
+TASKS_LOG_FORMAT=json - писать логи JSON-строками вместо текста
+TASKS_METRICS_FILE=путь - при выходе сохранить метрики (.prom - Prometheus, иначе JSON)
+"""
+import asyncio
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+ENABLED = os.environ.get('TASKS_INSTRUMENTATION', '1') != '0'
+LOG_FORMAT = os.environ.get('TASKS_LOG_FORMAT', 'text')
+METRICS_FILE = os.environ.get('TASKS_METRICS_FILE')
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Пишет в текущий sys.stdout (учитывает его подмену после создания обработчика)"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': record.created,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+logger = logging.getLogger('tasks')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_listener = None
+_quiet = False
+
+
+def _make_handler():
+    handler = StdoutHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter('%(message)s'))
+    return handler
+
+
+def _configure(use_queue):
+    """Основной процесс пишет через очередь; дочерние - напрямую, т.к. могут завершиться через os._exit"""
+    global _listener
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    _listener = None
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(log_queue, _make_handler())
+        _listener.start()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    else:
+        logger.addHandler(_make_handler())
+
+
+def flush():
+    """Дождаться вывода всех поставленных в очередь записей"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+
+@contextmanager
+def quiet():
+    """Временно не выводить логи (метрики продолжают собираться)"""
+    global _quiet
+    flush()
+    previous, _quiet = _quiet, True
+    try:
+        yield
+    finally:
+        _quiet = previous
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape_label(value):
+    """Экранирование значения метки по формату экспозиции Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    """Имя ряда Prometheus с метками: name{key="value",...}"""
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """Потокобезопасные счетчики и гистограммы с метками"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), 'buckets': list(h.buckets),
+                     'counts': list(h.counts), 'sum': h.sum, 'count': h.count}
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{_series(name, labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f"{_series(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{_series(name + '_sum', labels)} {h.sum}")
+                lines.append(f"{_series(name + '_count', labels)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+class NullMetrics(Metrics):
+    """Метрики отключенной инструментовки: запись ничего не делает, выгрузка пустая"""
+
+    def inc(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+metrics = Metrics() if ENABLED else NullMetrics()
+
+
+if ENABLED:
+    def log(message, **fields):
+        """Структурная запись: message - текст для человека, fields - поля для JSON"""
+        if not _quiet:
+            logger.info(message, extra={'fields': fields})
+
+    def span(name):
+        """Декоратор: время вызова, число вызовов и ошибок (обычные и async-функции)"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    except BaseException:
+                        metrics.inc(f"{name}_errors_total")
+                        raise
+                    finally:
+                        metrics.inc(f"{name}_calls_total")
+                        metrics.observe(f"{name}_duration_seconds", time.perf_counter() - start)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except BaseException:
+                    metrics.inc(f"{name}_errors_total")
+                    raise
+                finally:
+                    metrics.inc(f"{name}_calls_total")
+                    metrics.observe(f"{name}_duration_seconds", time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def timed(name):
+        """Замер времени блока кода"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.observe(f"{name}_duration_seconds", time.perf_counter() - start)
+
+    def _after_fork_in_child():
+        # Поток-слушатель не переживает fork: в дочернем процессе пишем напрямую
+        metrics._lock = threading.Lock()
+        _configure(use_queue=False)
+
+    def _shutdown():
+        if _listener is not None:
+            _listener.stop()
+
+    _configure(use_queue=multiprocessing.parent_process() is None)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+    atexit.register(_shutdown)
+    if METRICS_FILE:
+        atexit.register(lambda: metrics.save(METRICS_FILE))
+else:
+    def log(message, **fields):
+        pass
+
+    def span(name):
+        return lambda func: func
+
+    @contextmanager
+    def timed(name):
+        yield